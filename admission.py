@@ -0,0 +1,211 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from flask import current_app, g, jsonify, request
+
+import metrics
+
+'''
+Admission control
+Caps the requests a worker processes at once. Requests over the limit wait
+in a bounded queue ordered by route priority (reads before writes before
+bulk work) for at most ADMISSION_QUEUE_TIMEOUT seconds. A request that
+cannot wait is answered right away with 503 and Retry-After instead of
+piling up until the gunicorn timeout; when the queue is full a request of
+higher priority takes the place of the newest lowest priority waiter.
+Health checks (/, /health, /status and /health/db) and /metrics are never
+queued, so the load balancer and the scraper still reach a saturated
+worker. /health/db bypasses the limit as well: it runs one SELECT 1 and
+must report the database, a busy worker shows in the admission metrics.
+The limit is per worker process and matters with threaded or gevent
+workers (a sync worker serves one request at a time). It is off while
+ADMISSION_MAX_CONCURRENCY is 0.
+'''
+
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", 0))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 32))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 2))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 1))
+
+# Lower values are admitted first
+CRITICAL, READ, WRITE, BULK = 0, 1, 2, 3
+PRIORITIES = {
+    'critical': CRITICAL,
+    'read': READ,
+    'write': WRITE,
+    'bulk': BULK
+}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+
+# route rule -> priority, other routes are reads for GET and HEAD and
+# writes otherwise
+ROUTE_PRIORITIES = {
+    '/': CRITICAL,
+    '/health': CRITICAL,
+    '/status': CRITICAL,
+    '/health/db': CRITICAL,
+    '/metrics': CRITICAL,
+    '/actors/bulk': BULK,
+    '/movies/bulk': BULK,
+    '/actors/export': BULK,
+    '/movies/export': BULK
+}
+
+WAITING, ADMITTED, SHED = 'waiting', 'admitted', 'shed'
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+# ADMISSION_PRIORITIES="/search=bulk,/stats=read" overrides route priorities
+def parse_priorities(value):
+    priorities = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        rule, _, name = item.partition('=')
+        if name.strip() not in PRIORITIES:
+            raise ValueError(f'Unknown admission priority {name!r}')
+        priorities[rule.strip()] = PRIORITIES[name.strip()]
+    return priorities
+
+
+ADMISSION_PRIORITIES = parse_priorities(os.getenv("ADMISSION_PRIORITIES", ""))
+
+
+class _Waiter:
+    __slots__ = ('state',)
+
+    def __init__(self):
+        self.state = WAITING
+
+
+class ConcurrencyLimiter:
+    def __init__(self, max_concurrency, queue_size, queue_timeout):
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.condition = threading.Condition()
+        self.active = 0
+        # heap of (priority, arrival, waiter)
+        self.queue = []
+        self.arrivals = itertools.count()
+        self.rejected = {}
+
+    # Blocks until the request may run, returns the seconds it waited
+    def acquire(self, priority):
+        with self.condition:
+            if self.active < self.max_concurrency and not self.queue:
+                self.active += 1
+                return 0.0
+            if len(self.queue) >= self.queue_size:
+                worst = max(self.queue) if self.queue else None
+                if worst is None or worst[0] <= priority:
+                    self._reject(priority, 'queue_full')
+                self._remove(worst)
+                worst[2].state = SHED
+                self.condition.notify_all()
+            entry = (priority, next(self.arrivals), _Waiter())
+            heapq.heappush(self.queue, entry)
+            self._report()
+            started = time.monotonic()
+            deadline = started + self.queue_timeout
+            while entry[2].state == WAITING:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(entry)
+                    self._reject(priority, 'timeout')
+                self.condition.wait(remaining)
+            if entry[2].state == SHED:
+                self._reject(priority, 'shed')
+            return time.monotonic() - started
+
+    # Hands the slot to the first waiter or frees it
+    def release(self):
+        with self.condition:
+            if self.queue:
+                priority, arrival, waiter = heapq.heappop(self.queue)
+                waiter.state = ADMITTED
+                self.condition.notify_all()
+            else:
+                self.active -= 1
+            self._report()
+
+    def status(self):
+        with self.condition:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'active': self.active,
+                'queued': len(self.queue),
+                'rejected': dict(self.rejected)
+            }
+
+    def _remove(self, entry):
+        self.queue.remove(entry)
+        heapq.heapify(self.queue)
+        self._report()
+
+    def _reject(self, priority, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        metrics.count_admission_rejection(PRIORITY_NAMES[priority], reason)
+        raise AdmissionRejected(reason)
+
+    def _report(self):
+        metrics.set_admission_state(self.active, len(self.queue))
+
+
+def init_app(app):
+    limiter = None
+    if app.config['ADMISSION_MAX_CONCURRENCY'] > 0:
+        limiter = ConcurrencyLimiter(app.config['ADMISSION_MAX_CONCURRENCY'],
+                                     app.config['ADMISSION_QUEUE_SIZE'],
+                                     app.config['ADMISSION_QUEUE_TIMEOUT'])
+    app.extensions['admission'] = limiter
+
+
+def route_priority(config):
+    rule = request.url_rule.rule if request.url_rule is not None else None
+    priorities = config['ADMISSION_PRIORITIES']
+    if rule in priorities:
+        return priorities[rule]
+    if rule in ROUTE_PRIORITIES:
+        return ROUTE_PRIORITIES[rule]
+    return READ if request.method in ('GET', 'HEAD') else WRITE
+
+
+# before_request hook, returns the 503 response of a rejected request
+def admit():
+    limiter = current_app.extensions.get('admission')
+    if limiter is None:
+        return None
+    priority = route_priority(current_app.config)
+    if priority == CRITICAL:
+        return None
+    try:
+        waited = limiter.acquire(priority)
+    except AdmissionRejected as rejected:
+        response = jsonify({
+            "success": False,
+            "error": 503,
+            "message": "Service Unavailable: server is overloaded, "
+                       "retry later",
+            "reason": rejected.reason
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = \
+            str(current_app.config['ADMISSION_RETRY_AFTER'])
+        return response
+    g.admitted = limiter
+    metrics.observe_admission_wait(PRIORITY_NAMES[priority], waited)
+    return None
+
+
+# teardown hook, runs after streamed bodies are sent
+def release():
+    limiter = g.pop('admitted', None)
+    if limiter is not None:
+        limiter.release()
@@ -1,24 +1,163 @@
+import logging
+import operator
+import os
 import sys
+from functools import partial
 
-from flask import Flask, request, abort, jsonify, redirect
+from flask import (Flask, Blueprint, request, abort, jsonify, redirect,
+                   Response, stream_with_context, current_app)
 from flask_cors import CORS
 from flask_migrate import Migrate
-from auth.auth import AuthError, requires_auth
+from sqlalchemy import text
+from sqlalchemy.orm import (configure_mappers, contains_eager, joinedload,
+                            selectinload)
+from auth.auth import AuthError, requires_auth, check_permissions, jwks_store
 
+import admission
 import app_utils
+import compression
+import metrics
 from models.dbmodel import setup_db, Actor, Movie, db_drop_and_create_all, db
+from models.dbmodel import get_table_version, database_path, Casting
+from models.cache import response_cache, entity_cache, make_etag
+from models.pagination import paginate, SortKey, InvalidCursor
+from models.bulk import (parse_bulk_body, bulk_create, actor_row, movie_row,
+                         MAX_BULK_ITEMS)
+from models.export import export_rows, EXPORT_MIMETYPES, EXPORT_BATCH_SIZE
+from models.rows import (select_rows, iter_rows, partial_row_class,
+                         ROW_CLASSES, GENDERS)
+from models.stats import get_stats
+from models.search import search_ids, load_results
+from models.pool import pool_status
+from models import query_stats
+
+RESULTS_PER_PAGE = int(os.getenv("RESULTS_PER_PAGE", 6))
+MAX_RESULTS_PER_PAGE = int(os.getenv("MAX_RESULTS_PER_PAGE", 100))
+ACTOR_SORT_FIELDS = {'id': Actor.id, 'name': Actor.name, 'age': Actor.age}
+MOVIE_SORT_FIELDS = {
+    'id': Movie.id,
+    'title': Movie.title,
+    'release_date': Movie.release_date
+}
+SEARCH_PERMISSIONS = {
+    'actor': 'get:actors',
+    'movie': 'get:movie'
+}
+# Schema DDL is opt-in, production schemas are managed with `manage.py db`
+CREATE_TABLES = os.getenv("CREATE_TABLES", "false").lower() == "true"
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", 2))
+COMPRESS_RESPONSES = os.getenv("COMPRESS_RESPONSES", "true").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+api = Blueprint('api', __name__)
+migrate = Migrate()
+cors = CORS()
+
+
+'''
+Application factory
+Builds the app without touching the database: extensions are bound lazily
+and tables are only created when CREATE_TABLES is set. Workers call
+warmup() once after fork, before they accept traffic.
+'''
+
+
+def create_app(config=None):
+    config = dict(config or {})
+    app = Flask(__name__)
+    app.json_encoder = metrics.TimedJSONEncoder
+    setup_db(app, config.pop('SQLALCHEMY_DATABASE_URI', database_path))
+    app.config.setdefault('CREATE_TABLES', CREATE_TABLES)
+    app.config.setdefault('WARMUP_CONNECTIONS', WARMUP_CONNECTIONS)
+    app.config.setdefault('QUERY_ACCOUNTING', query_stats.QUERY_ACCOUNTING)
+    app.config.setdefault('QUERY_BUDGET', query_stats.QUERY_BUDGET)
+    app.config.setdefault('QUERY_REPEAT_LIMIT',
+                          query_stats.QUERY_REPEAT_LIMIT)
+    app.config.setdefault('QUERY_BUDGET_STRICT',
+                          query_stats.QUERY_BUDGET_STRICT)
+    app.config.setdefault('ADMISSION_MAX_CONCURRENCY',
+                          admission.ADMISSION_MAX_CONCURRENCY)
+    app.config.setdefault('ADMISSION_QUEUE_SIZE',
+                          admission.ADMISSION_QUEUE_SIZE)
+    app.config.setdefault('ADMISSION_QUEUE_TIMEOUT',
+                          admission.ADMISSION_QUEUE_TIMEOUT)
+    app.config.setdefault('ADMISSION_RETRY_AFTER',
+                          admission.ADMISSION_RETRY_AFTER)
+    app.config.setdefault('ADMISSION_PRIORITIES',
+                          admission.ADMISSION_PRIORITIES)
+    app.config.setdefault('COMPRESS_RESPONSES', COMPRESS_RESPONSES)
+    app.config.setdefault('COMPRESS_MIN_SIZE', compression.COMPRESS_MIN_SIZE)
+    app.config.setdefault('COMPRESS_LEVEL', compression.COMPRESS_LEVEL)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY',
+                          compression.COMPRESS_BROTLI_QUALITY)
+    app.config.update(config)
+    admission.init_app(app)
+    migrate.init_app(app, db)
+    cors.init_app(app, resources={r"*": {"origins": "*"}})
+    app.register_blueprint(api)
+    if app.config['CREATE_TABLES']:
+        with app.app_context():
+            db_drop_and_create_all()
+    return app
+
+
+# Opens pool connections and loads the signing keys ahead of the first
+# request. Connections inherited from a preloading parent are discarded.
+def warmup(app):
+    configure_mappers()
+    with app.app_context():
+        db.engine.dispose()
+        connections = []
+        try:
+            for i in range(app.config['WARMUP_CONNECTIONS']):
+                connection = db.engine.connect()
+                connection.execute(text('SELECT 1'))
+                connections.append(connection)
+        finally:
+            for connection in connections:
+                connection.close()
+    try:
+        jwks_store.refresh()
+    except Exception:
+        logger.exception('Unable to load JWKS during warmup')
+
+
+@api.before_app_request
+def start_timer():
+    metrics.start_request_timer()
+    query_stats.start_accounting(current_app.config)
+
+
+# Registered after start_timer, so the request latency includes the wait
+@api.before_app_request
+def admit_request():
+    return admission.admit()
+
+
+@api.teardown_app_request
+def release_request(exception):
+    admission.release()
+
+
+# after_request hooks run in reverse order, registered first so the body is
+# compressed once the other hooks are done with the response
+@api.after_app_request
+def compress_response(response):
+    return compression.compress_response(response, current_app.config)
 
-RESULTS_PER_PAGE = 6
 
-app = Flask(__name__)
-setup_db(app)
-migrate = Migrate(app, db)
-db_drop_and_create_all()
-CORS(app)
-cors = CORS(app, resources={r"*": {"origins": "*"}})
+@api.after_app_request
+def account_queries(response):
+    return query_stats.finish_accounting(response, current_app.config)
 
 
-@app.after_request
+@api.after_app_request
+def record_metrics(response):
+    return metrics.observe_request(response)
+
+
+@api.after_app_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Headers',
                          'Content-Type,Authorization,true')
@@ -27,9 +166,9 @@ def after_request(response):
     return response
 
 
-@app.route("/")
-@app.route("/health")
-@app.route("/status")
+@api.route("/")
+@api.route("/health")
+@api.route("/status")
 def app_greet():
     message = {
         "message": "Welcome to Casting Agency"
@@ -37,7 +176,32 @@ def app_greet():
     return jsonify(message)
 
 
-@app.route("/actors", methods=['POST'])
+@api.route("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.render_metrics()
+    return Response(body, content_type=content_type)
+
+
+@api.route("/health/db")
+def database_health():
+    status = {}
+    try:
+        status = pool_status(db.engine)
+        db.session.execute(text('SELECT 1'))
+        healthy = True
+    except:
+        logger.exception('Database health check failed')
+        healthy = False
+    finally:
+        db.session.remove()
+    result = {
+        "success": healthy,
+        "pool": status
+    }
+    return jsonify(result), 200 if healthy else 503
+
+
+@api.route("/actors", methods=['POST'])
 @requires_auth('add:actors')
 def create_actors(jwt):
     error = False
@@ -46,12 +210,7 @@ def create_actors(jwt):
         actor = Actor(name=data['name'], age=data['age'])
         actor.identifier = app_utils.generate_guid()
         if data['gender'] is not None:
-            if data['gender'].lower() == 'male':
-                actor.gender = 'M'
-            elif data['gender'].lower() == 'female':
-                actor.gender = 'F'
-            else:
-                actor.gender = 'U'
+            actor.gender = app_utils.get_gender_code(data['gender'])
         actor.insert()
     except:
         error = True
@@ -68,7 +227,7 @@ def create_actors(jwt):
     return jsonify(result)
 
 
-@app.route("/movies", methods=['POST'])
+@api.route("/movies", methods=['POST'])
 @requires_auth('add:movie')
 def create_movies(jwt):
     error = False
@@ -97,79 +256,591 @@ def create_movies(jwt):
     return jsonify(result)
 
 
-@app.route("/actors")
+@api.route("/actors/bulk", methods=['POST'])
+@requires_auth('add:actors')
+def create_actors_bulk(jwt):
+    return jsonify(create_in_bulk(Actor, 'actors', actor_row))
+
+
+@api.route("/movies/bulk", methods=['POST'])
+@requires_auth('add:movie')
+def create_movies_bulk(jwt):
+    return jsonify(create_in_bulk(Movie, 'movies', movie_row))
+
+
+def create_in_bulk(model, key, row_builder):
+    try:
+        items = parse_bulk_body(request, key)
+    except ValueError:
+        abort(400)
+    if len(items) == 0 or len(items) > MAX_BULK_ITEMS:
+        abort(400)
+    try:
+        results = bulk_create(model, items, row_builder)
+    except:
+        logger.exception('Bulk create failed')
+        abort(422)
+    created = sum(1 for result in results if 'id' in result)
+    return {
+        "success": True,
+        "created": created,
+        "failed": len(results) - created,
+        "results": results
+    }
+
+
+@api.route("/actors")
 @requires_auth('get:actors')
 def get_all_actors(jwt):
-    actors = Actor.query.all()
-    if len(actors) == 0:
+    return cached_list_response(Actor.__tablename__, list_actors)
+
+
+def list_actors():
+    page, per_page = get_page_args()
+    sort_key = get_sort_key(ACTOR_SORT_FIELDS, Actor.id)
+    row_class = get_row_class(Actor, sort_key)
+    query, filtered = filter_actors(Actor.query)
+    # only the unfiltered table count is cached
+    count_key = None if filtered else Actor.__tablename__
+    try:
+        selection = paginate(query, sort_key, page, per_page, Actor.id,
+                             cache_key=count_key,
+                             cursor=request.args.get('cursor'),
+                             fetch=partial(select_rows, Actor,
+                                           row_class=row_class))
+    except InvalidCursor:
+        abort(400)
+    if selection.total == 0:
         abort(404)
     result = {
         "success": True,
-        "actors": paginate_actors(actors),
-        'page': request.args.get('page', 1, type=int)
+        "actors": [actor.format() for actor in selection.items]
     }
-    return jsonify(result)
-
-
-def paginate_actors(selection):
-    page = request.args.get('page', 1, type=int)
-    start = (page - 1) * RESULTS_PER_PAGE
-    end = start + RESULTS_PER_PAGE
-    actors = list(map(Actor.format, selection))
-    current_actors = actors[start:end]
-    return current_actors
+    result.update(page_metadata(selection))
+    return result
 
 
-def paginate_movies(selection):
+def get_page_args():
     page = request.args.get('page', 1, type=int)
-    start = (page - 1) * RESULTS_PER_PAGE
-    end = start + RESULTS_PER_PAGE
-    movies = list(map(Movie.format, selection))
-    current_movies = movies[start:end]
-    return current_movies
+    per_page = request.args.get('per_page', RESULTS_PER_PAGE, type=int)
+    if page < 1 or per_page < 1:
+        abort(400)
+    return page, min(per_page, MAX_RESULTS_PER_PAGE)
+
+
+# fields=<field>,<field> limits the returned fields to the given ones of
+# model.FIELDS, None when the parameter is missing. Unknown fields are
+# rejected.
+def get_fields(model):
+    fields = request.args.get('fields')
+    if fields is None:
+        return None
+    names = {name.strip() for name in fields.split(',')}
+    if not names.issubset(model.FIELDS):
+        abort(400)
+    return tuple(field for field in model.FIELDS if field in names)
+
+
+# Row class of a list page: with fields= only the requested columns and
+# the ones of the sort key (for the cursor) are selected
+def get_row_class(model, sort_key):
+    fields = get_fields(model)
+    if fields is None:
+        return ROW_CLASSES[model]
+    needed = set(fields).union(column.key for column in sort_key.columns)
+    columns = tuple(field for field in model.FIELDS if field in needed)
+    return partial_row_class(model, columns, fields)
+
+
+# sort=<field> or sort=-<field> for descending order, ties are broken by id
+def get_sort_key(fields, id_column):
+    sort = request.args.get('sort', 'id')
+    name = sort[1:] if sort.startswith('-') else sort
+    if name not in fields:
+        abort(400)
+    columns = [fields[name]]
+    if name != 'id':
+        columns.append(id_column)
+    return SortKey(sort, columns, descending=sort.startswith('-'))
+
+
+# gender, min_age, max_age and name (prefix) filters, returns the query
+# and whether any filter was applied
+def filter_actors(query):
+    args = request.args
+    filters = []
+    if 'gender' in args:
+        filters.append(Actor.gender == app_utils.get_gender_code(
+            args['gender']))
+    for name, compare in (('min_age', operator.ge),
+                          ('max_age', operator.le)):
+        if name in args:
+            age = args.get(name, type=int)
+            if age is None:
+                abort(400)
+            filters.append(compare(Actor.age, age))
+    if args.get('name'):
+        filters.append(Actor.name.startswith(args['name'], autoescape=True))
+    return query.filter(*filters), bool(filters)
+
+
+# released_after, released_before (dd/mm/yyyy), production_house,
+# ott_partner and title (prefix) filters
+def filter_movies(query):
+    args = request.args
+    filters = []
+    for name, compare in (('released_after', operator.ge),
+                          ('released_before', operator.le)):
+        if name in args:
+            try:
+                release_date = app_utils.get_datetime(args[name])
+            except ValueError:
+                abort(400)
+            filters.append(compare(Movie.release_date, release_date))
+    for name in ('production_house', 'ott_partner'):
+        if name in args:
+            filters.append(getattr(Movie, name) == args[name])
+    if args.get('title'):
+        filters.append(Movie.title.startswith(args['title'], autoescape=True))
+    return query.filter(*filters), bool(filters)
+
+
+def page_metadata(selection):
+    return {
+        'page': selection.page,
+        'per_page': selection.per_page,
+        'total': selection.total,
+        'next_page': selection.next_page,
+        'next_cursor': selection.next_cursor
+    }
 
 
-@app.route("/movies")
+# include=cast embeds the cast of every movie on the page
+@api.route("/movies")
 @requires_auth('get:movie')
 def get_all_movies(jwt):
-    movies = Movie.query.all()
-    if len(movies) == 0:
+    depends_on = ()
+    if request.args.get('include') == 'cast':
+        depends_on = (Casting.__tablename__, Actor.__tablename__)
+    return cached_list_response(Movie.__tablename__, list_movies,
+                                depends_on)
+
+
+def list_movies():
+    page, per_page = get_page_args()
+    sort_key = get_sort_key(MOVIE_SORT_FIELDS, Movie.id)
+    row_class = get_row_class(Movie, sort_key)
+    query, filtered = filter_movies(Movie.query)
+    # only the unfiltered table count is cached
+    count_key = None if filtered else Movie.__tablename__
+    try:
+        selection = paginate(query, sort_key, page, per_page, Movie.id,
+                             cache_key=count_key,
+                             cursor=request.args.get('cursor'),
+                             fetch=partial(select_rows, Movie,
+                                           row_class=row_class))
+    except InvalidCursor:
+        abort(400)
+    if selection.total == 0:
         abort(404)
+    include = request.args.get('include')
+    if include not in (None, 'cast'):
+        abort(400)
+    movies = [movie.format() for movie in selection.items]
+    if include == 'cast':
+        casts = load_casts([row.id for row in selection.items])
+        for row, movie in zip(selection.items, movies):
+            movie['cast'] = casts.get(row.id, [])
     result = {
         "success": True,
-        "actors": paginate_movies(movies),
-        'page': request.args.get('page', 1, type=int)
+        "actors": movies
     }
+    result.update(page_metadata(selection))
+    return result
+
+
+# List pages are served from the response cache while the table version is
+# unchanged, If-None-Match is answered from the table version alone. Pages
+# embedding rows of other tables also depend on their versions.
+def cached_list_response(table, build_result, depends_on=()):
+    version = get_table_version(table)
+    if depends_on:
+        version = (version,) + tuple(get_table_version(name)
+                                     for name in depends_on)
+    key = (table, version, request.path,
+           tuple(sorted(request.args.items(multi=True))))
+    etag = make_etag(*key)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    body = response_cache.get(key)
+    if body is None:
+        body = jsonify(build_result()).get_data()
+        response_cache.put(key, body)
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+
+# Sparse fieldsets are other representations of the entity, their ETags
+# must not match the one of the full entity
+def entity_etag(model, entity_id, version, fields=None):
+    if fields is None:
+        return make_etag(model.__tablename__, entity_id, version)
+    return make_etag(model.__tablename__, entity_id, version, ','.join(fields))
+
+
+# Current row version, read from the version column only
+def get_entity_version(model, entity_id):
+    version = db.session.query(model.version) \
+        .filter(model.id == entity_id).scalar()
+    if version is None:
+        abort(404)
+    return version
+
+
+# Answers If-None-Match for a single row from its current version
+def entity_not_modified(model, entity_id, version, fields=None):
+    if not request.if_none_match:
+        return None
+    etag = entity_etag(model, entity_id, version, fields)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    return None
+
+
+def not_modified(etag):
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+@api.route("/actors/export")
+@requires_auth('get:actors')
+def export_actors(jwt):
+    query = filter_actors(export_query(Actor))[0]
+    return export_response(query, Actor, 'actors')
+
+
+@api.route("/movies/export")
+@requires_auth('get:movie')
+def export_movies(jwt):
+    query = filter_movies(export_query(Movie))[0]
+    return export_response(query, Movie, 'movies')
+
+
+# since=<id> exports only rows created after that id
+def export_query(model):
+    query = model.query.order_by(model.id)
+    if 'since' in request.args:
+        since = request.args.get('since', type=int)
+        if since is None:
+            abort(400)
+        query = query.filter(model.id > since)
+    return query
+
+
+def export_response(query, model, name):
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_MIMETYPES:
+        abort(400)
+    row_class = ROW_CLASSES[model]
+    rows = export_rows(iter_rows(model, query, EXPORT_BATCH_SIZE),
+                       row_class.format, model.FIELDS, export_format)
+    response = Response(stream_with_context(rows),
+                        mimetype=EXPORT_MIMETYPES[export_format])
+    response.headers['Content-Disposition'] = \
+        f'attachment; filename={name}.{export_format}'
+    return response
+
+
+# Served from the catalogue_stats counters, sections the token may not
+# read are left out
+@api.route("/stats")
+@requires_auth()
+def catalogue_stats(jwt):
+    granted = jwt.get('permissions', [])
+    if 'get:actors' not in granted and 'get:movie' not in granted:
+        raise AuthError({
+            'code': 'unauthorized',
+            'description': 'Permission not found.'
+        }, 401)
+    stats = get_stats()
+    result = {"success": True}
+    if 'get:actors' in granted:
+        by_gender = {GENDERS.get(gender, 'Unknown'): count for gender, count
+                     in stats.get('actor_gender', {}).items()}
+        result['actors'] = {
+            "total": sum(by_gender.values()),
+            "by_gender": by_gender,
+            "by_age": stats.get('actor_age', {})
+        }
+    if 'get:movie' in granted:
+        by_ott_partner = stats.get('movie_ott_partner', {})
+        result['movies'] = {
+            "total": sum(by_ott_partner.values()),
+            "by_production_house": stats.get('movie_production_house', {}),
+            "by_ott_partner": by_ott_partner
+        }
     return jsonify(result)
 
 
-@app.route("/actors/<int:actor_id>")
+# type=actor|movie restricts the search, otherwise every type the token
+# may read is searched
+@api.route("/search")
+@requires_auth()
+def search(jwt):
+    q = request.args.get('q', '').strip()
+    if not q:
+        abort(400)
+    kind = request.args.get('type')
+    if kind is not None:
+        if kind not in SEARCH_PERMISSIONS:
+            abort(400)
+        kinds = [kind]
+    else:
+        granted = jwt.get('permissions', [])
+        kinds = [kind for kind, permission in SEARCH_PERMISSIONS.items()
+                 if permission in granted] or list(SEARCH_PERMISSIONS)
+    for kind in kinds:
+        check_permissions(SEARCH_PERMISSIONS[kind], jwt)
+
+    page, per_page = get_page_args()
+    matches = search_ids(q, kinds, per_page + 1, (page - 1) * per_page)
+    results = load_results(matches[:per_page])
+    if len(results) == 0:
+        abort(404)
+    return jsonify({
+        "success": True,
+        "results": results,
+        "page": page,
+        "per_page": per_page,
+        "next_page": page + 1 if len(matches) > per_page else None
+    })
+
+
+@api.route("/actors/<int:actor_id>")
 @requires_auth('get:actors')
 def get_actor_info(jwt, actor_id):
-    actor = Actor.query.filter(Actor.id == actor_id).first()
-    if actor is None:
-        abort(404)
+    fields = get_fields(Actor)
+    version = get_entity_version(Actor, actor_id)
+    cached = entity_not_modified(Actor, actor_id, version, fields)
+    if cached is not None:
+        return cached
+    details, version = get_entity_details(Actor, actor_id, version, fields)
     result = {
         "success": True,
-        "actor_details": actor.format()
+        "actor_details": details
     }
-    return jsonify(result)
+    response = jsonify(result)
+    response.set_etag(entity_etag(Actor, actor_id, version, fields))
+    return response
 
 
-@app.route("/movies/<int:movie_id>")
+@api.route("/movies/<int:movie_id>")
 @requires_auth('get:movie')
 def get_movie_info(jwt, movie_id):
-    movie = Movie.query.filter(Movie.id == movie_id).first()
-    if movie is None:
-        abort(404)
+    fields = get_fields(Movie)
+    version = get_entity_version(Movie, movie_id)
+    cached = entity_not_modified(Movie, movie_id, version, fields)
+    if cached is not None:
+        return cached
+    details, version = get_entity_details(Movie, movie_id, version, fields)
+    result = {
+        "success": True,
+        "movie_details": details
+    }
+    response = jsonify(result)
+    response.set_etag(entity_etag(Movie, movie_id, version, fields))
+    return response
+
+
+@api.route("/actors/by-identifier/<uuid:identifier>")
+@requires_auth('get:actors')
+def get_actor_by_identifier(jwt, identifier):
+    fields = get_fields(Actor)
+    actor = get_entity_row(Actor, Actor.identifier == identifier, fields)
+    result = {
+        "success": True,
+        "actor_details": actor.format()
+    }
+    response = jsonify(result)
+    response.set_etag(entity_etag(Actor, actor.id, actor.version, fields))
+    return response
+
+
+@api.route("/movies/by-identifier/<uuid:identifier>")
+@requires_auth('get:movie')
+def get_movie_by_identifier(jwt, identifier):
+    fields = get_fields(Movie)
+    movie = get_entity_row(Movie, Movie.identifier == identifier, fields)
     result = {
         "success": True,
         "movie_details": movie.format()
     }
-    return jsonify(result)
+    response = jsonify(result)
+    response.set_etag(entity_etag(Movie, movie.id, movie.version, fields))
+    return response
+
 
+# Read-through lookup of the formatted entity and its row version. Entries
+# of another version than the current one (changed by another worker) are
+# misses. Sparse fieldsets are cut from a cached entity, otherwise only
+# their columns are read and the cache is left alone.
+def get_entity_details(model, entity_id, version, fields=None):
+    cached = entity_cache.get(model.__tablename__, entity_id)
+    if cached is not None and cached[1] == version:
+        details, version = cached
+        if fields is not None:
+            details = {field: details[field] for field in fields}
+        return details, version
+    if fields is not None:
+        row = get_entity_row(model, model.id == entity_id, fields)
+        return row.format(), row.version
+    entity = model.query.filter(model.id == entity_id).first()
+    if entity is None:
+        abort(404)
+    return entity_cache.put(model.__tablename__, entity_id,
+                            (entity.format(), entity.version))
+
+
+# Single row of model with the given fields (all when None), its id and
+# version
+def get_entity_row(model, criterion, fields=None):
+    fields = fields or model.FIELDS
+    columns = tuple(dict.fromkeys(fields + ('id', 'version')))
+    rows = select_rows(model, model.query.filter(criterion).limit(1),
+                       partial_row_class(model, columns, fields))
+    if not rows:
+        abort(404)
+    return rows[0]
 
-@app.route("/actors/<int:actor_id>", methods=['DELETE'])
+
+# Cast of the given movies by movie id with one query, the same
+# IN (...) load selectinload runs for a collection
+def load_casts(movie_ids):
+    casts = {}
+    if not movie_ids:
+        return casts
+    castings = Casting.query.options(joinedload(Casting.actor)) \
+        .filter(Casting.movie_id.in_(movie_ids)) \
+        .order_by(Casting.movie_id, Casting.billing_order, Casting.actor_id)
+    for casting in castings:
+        casts.setdefault(casting.movie_id, []).append(
+            cast_member(casting))
+    return casts
+
+
+def cast_member(casting):
+    member = casting.format()
+    member['actor'] = casting.actor.format()
+    return member
+
+
+@api.route("/movies/<int:movie_id>/cast")
+@requires_auth('get:movie')
+def get_movie_cast(jwt, movie_id):
+    movie = Movie.query.options(
+        selectinload(Movie.cast).joinedload(Casting.actor)) \
+        .filter(Movie.id == movie_id).first()
+    if movie is None:
+        abort(404)
+    return jsonify({
+        "success": True,
+        "movie_id": movie.id,
+        "cast": [cast_member(casting) for casting in movie.cast]
+    })
+
+
+# Body: actor_id, role (optional) and billing_order (optional, defaults to
+# the end of the billing)
+@api.route("/movies/<int:movie_id>/cast", methods=['POST'])
+@requires_auth('modify:movie')
+def add_movie_cast(jwt, movie_id):
+    data = request.get_json(silent=True)
+    # bool is an int subclass, true must not pass as actor 1
+    if not isinstance(data, dict) or \
+            not isinstance(data.get('actor_id'), int) or \
+            isinstance(data['actor_id'], bool):
+        abort(400)
+    billing_order = data.get('billing_order')
+    role = data.get('role')
+    if billing_order is not None and (not isinstance(billing_order, int)
+                                      or isinstance(billing_order, bool)
+                                      or billing_order < 1):
+        abort(400)
+    if role is not None and (not isinstance(role, str) or len(role) > 100):
+        abort(400)
+    movie = Movie.query.get(movie_id)
+    actor = Actor.query.get(data['actor_id'])
+    if movie is None or actor is None:
+        abort(404)
+    if Casting.query.get((movie_id, actor.id)) is not None:
+        abort(422)
+    if billing_order is None:
+        last = db.session.query(db.func.max(Casting.billing_order)) \
+            .filter(Casting.movie_id == movie_id).scalar()
+        billing_order = (last or 0) + 1
+    casting = Casting(movie_id=movie_id, actor_id=actor.id, role=role,
+                      billing_order=billing_order)
+    try:
+        casting.insert()
+    except:
+        db.session.rollback()
+        logger.exception('Adding cast member failed')
+        abort(422)
+    return jsonify({
+        "success": True,
+        "movie_id": movie_id,
+        "actor_id": actor.id,
+        "billing_order": billing_order
+    })
+
+
+@api.route("/movies/<int:movie_id>/cast/<int:actor_id>",
+           methods=['DELETE'])
+@requires_auth('modify:movie')
+def remove_movie_cast(jwt, movie_id, actor_id):
+    casting = Casting.query.get((movie_id, actor_id))
+    if casting is None:
+        abort(404)
+    try:
+        casting.delete()
+    except:
+        db.session.rollback()
+        logger.exception('Removing cast member failed')
+        abort(422)
+    return jsonify({
+        "success": True,
+        "movie_id": movie_id,
+        "actor_id": actor_id,
+        "status": "Deleted"
+    })
+
+
+# Movies of an actor, newest release first
+@api.route("/actors/<int:actor_id>/filmography")
+@requires_auth('get:actors')
+def get_actor_filmography(jwt, actor_id):
+    actor = Actor.query.filter(Actor.id == actor_id).first()
+    if actor is None:
+        abort(404)
+    castings = Casting.query.join(Casting.movie) \
+        .options(contains_eager(Casting.movie)) \
+        .filter(Casting.actor_id == actor_id) \
+        .order_by(Movie.release_date.desc(), Movie.id)
+    filmography = []
+    for casting in castings:
+        credit = casting.format()
+        credit['movie'] = casting.movie.format()
+        filmography.append(credit)
+    return jsonify({
+        "success": True,
+        "actor": actor.format(),
+        "filmography": filmography
+    })
+
+
+@api.route("/actors/<int:actor_id>", methods=['DELETE'])
 @requires_auth('delete:actors')
 def delete_actor(jwt, actor_id):
     error = False
@@ -193,7 +864,7 @@ def delete_actor(jwt, actor_id):
     return jsonify(result)
 
 
-@app.route("/movies/<int:movie_id>", methods=['DELETE'])
+@api.route("/movies/<int:movie_id>", methods=['DELETE'])
 @requires_auth('delete:movie')
 def delete_movie(jwt, movie_id):
     error = False
@@ -217,7 +888,7 @@ def delete_movie(jwt, movie_id):
     return jsonify(result)
 
 
-@app.route("/actors/<int:actor_id>", methods=['PATCH'])
+@api.route("/actors/<int:actor_id>", methods=['PATCH'])
 @requires_auth('modify:actors')
 def update_actor_info(jwt, actor_id):
     error = False
@@ -231,12 +902,7 @@ def update_actor_info(jwt, actor_id):
         if 'age' in data:
             actor.age = data['age']
         if 'gender' in data:
-            if data['gender'].lower() == 'male':
-                actor.gender = 'M'
-            elif data['gender'].lower() == 'female':
-                actor.gender = 'F'
-            else:
-                actor.gender = 'U'
+            actor.gender = app_utils.get_gender_code(data['gender'])
         actor.update()
     except:
         error = True
@@ -249,7 +915,7 @@ def update_actor_info(jwt, actor_id):
     return jsonify(result)
 
 
-@app.route("/movies/<int:movie_id>", methods=['PATCH'])
+@api.route("/movies/<int:movie_id>", methods=['PATCH'])
 @requires_auth('modify:movie')
 def update_movie_info(jwt, movie_id):
     error = False
@@ -278,7 +944,7 @@ def update_movie_info(jwt, movie_id):
     return jsonify(result)
 
 
-@app.errorhandler(422)
+@api.app_errorhandler(422)
 def unprocessable(error):
     return jsonify({
         "success": False,
@@ -287,7 +953,7 @@ def unprocessable(error):
     }), 422
 
 
-@app.errorhandler(400)
+@api.app_errorhandler(400)
 def bad_request(error):
     return jsonify({
         "success": False,
@@ -296,7 +962,7 @@ def bad_request(error):
     }), 400
 
 
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(error):
     return jsonify(
         {
@@ -308,12 +974,14 @@ def not_found(error):
 
 
 # Error Handler for Token Validations, verification errors
-@app.errorhandler(AuthError)
+@api.app_errorhandler(AuthError)
 def auth_error(error):
     response = jsonify(error.error)
     response.status_code = error.status_code
     return response
 
 
+app = create_app()
+
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,67 @@
+import json
+import os
+from datetime import date
+
+from flask.json import JSONEncoder
+
+import app_utils
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+'''
+JSON encoding
+Encoder of all response bodies (set as app.json_encoder, so jsonify in the
+routes and error handlers uses it) and of the NDJSON exports. Bodies are
+encoded with orjson when it is installed and JSON_ENCODER is not `stdlib`,
+otherwise with the standard library. Dates and datetimes are written in the
+API format dd/mm/yyyy by the encoder, models keep them as date objects.
+Pretty printed bodies (JSONIFY_PRETTYPRINT_REGULAR) always use the standard
+library, orjson only indents by two spaces.
+'''
+
+JSON_ENCODER = os.getenv("JSON_ENCODER", "auto").lower()
+USE_ORJSON = orjson is not None and JSON_ENCODER != 'stdlib'
+
+if USE_ORJSON:
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def default(o):
+    if isinstance(o, date):
+        return app_utils.get_datetime_as_str(o)
+    raise TypeError(f'Object of type {type(o).__name__} '
+                    f'is not JSON serializable')
+
+
+class APIJSONEncoder(JSONEncoder):
+    def default(self, o):
+        if isinstance(o, date):
+            return app_utils.get_datetime_as_str(o)
+        return super().default(o)
+
+    def encode(self, o):
+        if not USE_ORJSON or self.indent is not None:
+            return super().encode(o)
+        options = ORJSON_OPTIONS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(o, default=self.default,
+                            option=options).decode('utf-8')
+
+
+# Compact encoding outside of a request, used for NDJSON lines
+def dumps(o):
+    if USE_ORJSON:
+        return orjson.dumps(o, default=default,
+                            option=ORJSON_OPTIONS).decode('utf-8')
+    return json.dumps(o, default=default, separators=(',', ':'))
+
+
+# Plain value for text formats such as CSV
+def text_value(value):
+    if isinstance(value, date):
+        return app_utils.get_datetime_as_str(value)
+    return value
@@ -1,20 +1,48 @@
+import os
+import time
 import uuid
-from datetime import datetime
+from datetime import date, datetime
 import random
 
 
+# UUID version 7: 48 bit unix timestamp in milliseconds followed by random
+# bits, new identifiers are appended to the end of the unique index instead
+# of being scattered across it
 def generate_guid():
-    return str(uuid.uuid4())
+    timestamp_ms = time.time_ns() // 1000000
+    value = (timestamp_ms & 0xFFFFFFFFFFFF) << 80
+    value |= int.from_bytes(os.urandom(10), 'big')
+    value = (value & ~(0xF << 76)) | (0x7 << 76)
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)
+    return str(uuid.UUID(int=value))
 
 
+# dd/mm/yyyy, well formed strings are split by position instead of going
+# through strptime
 def get_datetime(date_string):
+    if len(date_string) == 10 and date_string[2] == '/' \
+            and date_string[5] == '/' and date_string[:2].isdigit() \
+            and date_string[3:5].isdigit() and date_string[6:].isdigit():
+        return date(int(date_string[6:]), int(date_string[3:5]),
+                    int(date_string[:2]))
     format_str = '%d/%m/%Y'
     datetime_obj = datetime.strptime(date_string, format_str)
     return datetime_obj.date()
 
 
+# dd/mm/yyyy, called for every date in a response body so strftime and
+# its locale handling are avoided
 def get_datetime_as_str(datetime_obj):
-    return datetime_obj.strftime("%d/%m/%Y")
+    return (f'{datetime_obj.day:02d}/{datetime_obj.month:02d}/'
+            f'{datetime_obj.year:04d}')
+
+
+def get_gender_code(gender):
+    if gender.lower() == 'male':
+        return 'M'
+    elif gender.lower() == 'female':
+        return 'F'
+    return 'U'
 
 
 def get_gender_char():
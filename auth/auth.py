@@ -1,17 +1,38 @@
-import json
 from flask import request, _request_ctx_stack, abort
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
 import os
+import time
+
+import metrics
+
+from auth.jwks import JWKSKeyStore, verify_signature
+from auth.token_cache import VerifiedTokenCache
 
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN")
 ALGORITHMS = [os.getenv("ALGORITHMS")]
 API_AUDIENCE = os.getenv("API_AUDIENCE")
+# Set JWKS_FILE to a local jwks.json to verify tokens without Auth0
+JWKS_FILE = os.getenv("JWKS_FILE")
+JWKS_CACHE_TTL = int(os.getenv("JWKS_CACHE_TTL", 3600))
+JWKS_MIN_REFRESH_INTERVAL = int(os.getenv("JWKS_MIN_REFRESH_INTERVAL", 30))
+JWKS_FETCH_TIMEOUT = float(os.getenv("JWKS_FETCH_TIMEOUT", 5))
+# Number of verified tokens kept in memory, 0 disables the cache
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 1024))
 # AUTH0_DOMAIN = 'ravikr42.auth0.com'
 # ALGORITHMS = ['RS256']
 # API_AUDIENCE = 'casting'
 
+jwks_store = JWKSKeyStore(
+    url=f'https://{AUTH0_DOMAIN}/.well-known/jwks.json',
+    path=JWKS_FILE,
+    ttl=JWKS_CACHE_TTL,
+    min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+    timeout=JWKS_FETCH_TIMEOUT,
+    algorithm=ALGORITHMS[0]
+)
+token_cache = VerifiedTokenCache(maxsize=TOKEN_CACHE_SIZE)
+
 # AuthError Exception
 '''
 AuthError Exception
@@ -55,16 +76,19 @@ def get_token_auth_header():
     token = parts[1]
     return token
 
-# method to check permission in JWT Token
-def check_permissions(permissions, payload):
-    if "permissions" not in payload:
-        raise AuthError(
-            {
-                'code': 'invalid claims',
-                'description': 'permission is not included in access token'
-            }, 400
-        )
-    if permissions not in payload['permissions']:
+# method to check permission in JWT Token, granted can be the precomputed
+# permission set of a cached token
+def check_permissions(permissions, payload, granted=None):
+    if granted is None:
+        if "permissions" not in payload:
+            raise AuthError(
+                {
+                    'code': 'invalid claims',
+                    'description': 'permission is not included in access token'
+                }, 400
+            )
+        granted = payload['permissions']
+    if permissions not in granted:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -74,33 +98,26 @@ def check_permissions(permissions, payload):
 
 # Code to decode and validate Token
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
     if rsa_key:
         try:
+            # signature is checked with the cached key object, jwt.decode
+            # then only validates the claims
+            verify_signature(token, rsa_key, ALGORITHMS)
             payload = jwt.decode(
                 token,
-                rsa_key,
+                None,
                 algorithms=ALGORITHMS,
                 audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
+                issuer='https://' + AUTH0_DOMAIN + '/',
+                options={'verify_signature': False}
             )
 
             return payload
@@ -128,20 +145,34 @@ def verify_decode_jwt(token):
     }, 400)
 
 
-def requires_auth(permission=''):
+# permission=None only requires a valid token, the view checks permissions
+def requires_auth(permission=None):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            try:
-                payload = verify_decode_jwt(token)
-            except:
-                raise AuthError({
-                    'code': 'forbidden',
-                    'description': 'Invalid Token Supplied'
-                }, 401)
-            check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
+            started = time.perf_counter()
+            verified = token_cache.get(token)
+            metrics.count_token_cache_lookup(verified is not None)
+            source = 'cache'
+            if verified is None:
+                source = 'verified'
+                try:
+                    payload = verify_decode_jwt(token)
+                except:
+                    metrics.observe_jwt_verification(
+                        'rejected', time.perf_counter() - started)
+                    raise AuthError({
+                        'code': 'forbidden',
+                        'description': 'Invalid Token Supplied'
+                    }, 401)
+                verified = token_cache.put(token, payload)
+            metrics.observe_jwt_verification(
+                source, time.perf_counter() - started)
+            if permission is not None:
+                check_permissions(permission, verified.payload,
+                                  verified.permissions)
+            return f(verified.payload, *args, **kwargs)
 
         return wrapper
 
@@ -0,0 +1,155 @@
+import json
+import logging
+import threading
+import time
+from urllib.request import urlopen
+
+from jose import jwk, jwt
+from jose.exceptions import JWTError
+from jose.utils import base64url_decode
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ALGORITHM = 'RS256'
+
+'''
+JWKS key store
+Keeps the signing keys of the identity provider in process, indexed by kid
+and already parsed into key objects, so verifying a token does not need an
+outbound request. Keys are re-read once the TTL has passed; until the new
+set arrives the previous one keeps being served (stale-while-revalidate).
+A token signed with an unknown kid forces a refresh, at most once every
+`min_refresh_interval` seconds; a failed first load is retried at the same
+rate. Fetches run outside the lock, only swapping in the new set is locked.
+'''
+
+
+class KeySetUnavailable(Exception):
+    pass
+
+
+class JWKSKeyStore:
+    def __init__(self, url=None, path=None, ttl=3600,
+                 min_refresh_interval=30, timeout=5,
+                 algorithm=DEFAULT_ALGORITHM):
+        self.url = url
+        self.path = path
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.algorithm = algorithm or DEFAULT_ALGORITHM
+        self._keys = None
+        self._fetched_at = 0.0
+        self._attempted_at = 0.0
+        # guards the key set and timestamps, never held during a fetch
+        self._lock = threading.Lock()
+        # serializes loads while there is no key set to serve
+        self._load_lock = threading.Lock()
+        # held by the running background refresh
+        self._refreshing = threading.Lock()
+
+    def get_key(self, kid):
+        if self._keys is None:
+            self._initial_load()
+        elif time.monotonic() - self._fetched_at > self.ttl:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and self._claim_refresh():
+            key = self._fetch().get(kid)
+        return key
+
+    def refresh(self):
+        with self._lock:
+            self._attempted_at = time.monotonic()
+        return self._fetch()
+
+    def clear(self):
+        with self._lock:
+            self._keys = None
+            self._fetched_at = 0.0
+            self._attempted_at = 0.0
+
+    def _may_refresh(self):
+        return (time.monotonic() - self._attempted_at
+                >= self.min_refresh_interval)
+
+    # Records a refresh attempt unless one happened within
+    # min_refresh_interval
+    def _claim_refresh(self):
+        with self._lock:
+            if not self._may_refresh():
+                return False
+            self._attempted_at = time.monotonic()
+            return True
+
+    # Loads and parses the key set without holding the lock, requests keep
+    # reading the current one meanwhile
+    def _fetch(self):
+        keys = self._parse(self._load_document())
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+        return keys
+
+    # Requests without a key set wait for one load; after a failure they
+    # fail fast until min_refresh_interval has passed
+    def _initial_load(self):
+        with self._load_lock:
+            if self._keys is not None:
+                return
+            if not self._claim_refresh():
+                raise KeySetUnavailable('JWKS could not be loaded, next '
+                                        'attempt after min_refresh_interval')
+            self._fetch()
+
+    def _refresh_in_background(self):
+        if not self._refreshing.acquire(blocking=False):
+            return
+        if not self._claim_refresh():
+            self._refreshing.release()
+            return
+        thread = threading.Thread(target=self._background_refresh,
+                                  name='jwks-refresh', daemon=True)
+        thread.start()
+
+    def _background_refresh(self):
+        try:
+            self._fetch()
+        except Exception:
+            # keep serving the stale key set, a later request retries
+            logger.exception('Unable to refresh JWKS, serving cached keys')
+        finally:
+            self._refreshing.release()
+
+    def _load_document(self):
+        if self.path:
+            with open(self.path) as jwks_file:
+                return json.load(jwks_file)
+        if not self.url:
+            raise ValueError('JWKS url or path must be configured')
+        with urlopen(self.url, timeout=self.timeout) as jsonurl:
+            return json.loads(jsonurl.read())
+
+    def _parse(self, jwks):
+        keys = {}
+        for key in jwks.get('keys', []):
+            if key.get('kty') != 'RSA' or 'kid' not in key:
+                continue
+            if key.get('use', 'sig') != 'sig':
+                continue
+            algorithm = key.get('alg', self.algorithm)
+            keys[key['kid']] = jwk.construct(key, algorithm)
+        return keys
+
+
+# Verifies the token signature against an already parsed key object
+def verify_signature(token, key, algorithms):
+    header = jwt.get_unverified_header(token)
+    if header.get('alg') not in algorithms:
+        raise JWTError('The specified alg value is not allowed')
+    signing_input, _, crypto_segment = token.rpartition('.')
+    signature = base64url_decode(crypto_segment.encode('utf-8'))
+    if not key.verify(signing_input.encode('utf-8'), signature):
+        raise JWTError('Signature verification failed.')
+    return True
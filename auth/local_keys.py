@@ -0,0 +1,39 @@
+import time
+
+import rsa
+from jose import jwk, jwt
+
+'''
+Local signing keys
+An RSA key pair and the matching JWKS document that stand in for Auth0 in
+offline tests and benchmarks: write the JWKS to a file, point JWKS_FILE at
+it and sign tokens with sign_token().
+'''
+
+
+def generate_local_jwks(kid='local-test-key', bits=1024):
+    public_key, private_key = rsa.newkeys(bits)
+    private_pem = private_key.save_pkcs1().decode('utf-8')
+    public_jwk = jwk.construct(private_pem, 'RS256').public_key().to_dict()
+    public_jwk.update({
+        'kid': kid,
+        'use': 'sig',
+        'n': public_jwk['n'].decode('utf-8'),
+        'e': public_jwk['e'].decode('utf-8')
+    })
+    return private_pem, {'keys': [public_jwk]}
+
+
+def sign_token(private_pem, kid, permissions, issuer, audience,
+               subject='local-tester', lifetime=3600):
+    now = int(time.time())
+    claims = {
+        'iss': issuer,
+        'sub': subject,
+        'aud': audience,
+        'iat': now,
+        'exp': now + lifetime,
+        'permissions': list(permissions)
+    }
+    return jwt.encode(claims, private_pem, algorithm='RS256',
+                      headers={'kid': kid})
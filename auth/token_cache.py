@@ -0,0 +1,74 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+'''
+Verified token cache
+Bounded LRU of already verified JWT payloads keyed by the SHA-256 digest of
+the raw token. An entry lives until the `exp` claim of its token, so a
+client re-using the same bearer token skips the signature verification
+and gets its permissions from a precomputed frozenset.
+'''
+
+VerifiedToken = namedtuple('VerifiedToken',
+                           ['payload', 'permissions', 'expires_at'])
+
+
+class VerifiedTokenCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        key = self.digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, token, payload):
+        permissions = None
+        if 'permissions' in payload:
+            permissions = frozenset(payload['permissions'])
+        entry = VerifiedToken(payload, permissions, payload.get('exp'))
+        # tokens without expiry are never cached
+        if self.maxsize <= 0 or not isinstance(entry.expires_at,
+                                                (int, float)):
+            return entry
+        key = self.digest(token)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,302 @@
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from faker import Faker
+from sqlalchemy.engine.url import make_url
+
+from auth.local_keys import generate_local_jwks, sign_token
+
+'''
+Benchmark
+Seeds a database with Faker data, serves the app in-process on a threaded
+server with a local JWKS standing in for Auth0, drives the endpoints with
+concurrent clients and prints throughput and latency percentiles as JSON.
+Runs are reproducible for a given --seed and can be compared with
+--compare <previous report>.
+
+    python benchmark.py --actors 5000 --movies 2000 --requests 500 \
+        --concurrency 8 --output before.json
+    python benchmark.py ... --compare before.json
+
+By default a throwaway SQLite database is used, pass --database to run
+against PostgreSQL (the tables are created when missing and the seed rows
+are added to it).
+'''
+
+KID = 'benchmark-key'
+ISSUER_DOMAIN = 'benchmark.local'
+AUDIENCE = 'casting'
+PERMISSIONS = ['add:actors', 'add:movie', 'delete:actors', 'delete:movie',
+               'get:actors', 'get:movie', 'modify:actors', 'modify:movie']
+PERCENTILES = (50, 95, 99)
+
+
+# name -> (method, function returning the path and JSON body of a request)
+def build_scenarios(actor_ids, movie_ids, deletable, words):
+    deletable = iter(deletable)
+    lock = threading.Lock()
+
+    def next_deletable():
+        with lock:
+            return next(deletable)
+
+    return {
+        'list_actors': ('GET', lambda: (
+            f'/actors?page={random.randint(1, 20)}', None)),
+        'list_actors_sorted': ('GET', lambda: (
+            '/actors?sort=-age&gender=female&per_page=20', None)),
+        'list_movies': ('GET', lambda: (
+            f'/movies?page={random.randint(1, 20)}', None)),
+        'get_actor': ('GET', lambda: (
+            f'/actors/{random.choice(actor_ids)}', None)),
+        'get_movie': ('GET', lambda: (
+            f'/movies/{random.choice(movie_ids)}', None)),
+        'search': ('GET', lambda: (
+            f'/search?q={random.choice(words)}', None)),
+        'export_actors': ('GET', lambda: (
+            '/actors/export?format=ndjson', None)),
+        'create_actor': ('POST', lambda: ('/actors', {
+            'name': 'Benchmark Actor',
+            'age': random.randint(18, 90),
+            'gender': random.choice(['male', 'female'])
+        })),
+        'update_movie': ('PATCH', lambda: (
+            f'/movies/{random.choice(movie_ids)}',
+            {'ott_partner': random.choice(['Netflix', 'Prime', 'Hotstar'])})),
+        'delete_actor': ('DELETE', lambda: (
+            f'/actors/{next_deletable()}', None))
+    }
+
+
+def seed(app, actors, movies, reserved, seed_value):
+    from models.bulk import insert_rows
+    from models.dbmodel import Actor, Movie, db_drop_and_create_all
+    import app_utils
+
+    faker = Faker()
+    Faker.seed(seed_value)
+    names = [faker.name() for i in range(actors + reserved)]
+    with app.app_context():
+        db_drop_and_create_all()
+        actor_ids = insert_rows(Actor, [{
+            'name': name,
+            'age': faker.random_int(18, 90),
+            'gender': faker.random_element(['M', 'F']),
+            'identifier': app_utils.generate_guid()
+        } for name in names])
+        movie_ids = insert_rows(Movie, [{
+            'title': faker.catch_phrase(),
+            'release_date': faker.date_time_between(
+                date(1990, 1, 1), date(2022, 12, 31)),
+            'production_house': faker.company()[:50],
+            'ott_partner': faker.random_element(
+                ['Netflix', 'Prime', 'Hotstar']),
+            'identifier': app_utils.generate_guid()
+        } for i in range(movies)])
+    actor_ids = sorted(actor_ids.values())
+    # search terms that match seeded actors
+    words = [name.split()[-1].lower() for name in names[:50]]
+    return (actor_ids[:actors], sorted(movie_ids.values()),
+            actor_ids[actors:], words)
+
+
+def start_server(app):
+    from werkzeug.serving import make_server
+
+    # access log lines would be part of the measured latency
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def timed_request(port, method, path, body, token):
+    headers = {'Authorization': 'Bearer ' + token}
+    payload = None
+    if body is not None:
+        payload = json.dumps(body)
+        headers['Content-Type'] = 'application/json'
+    started = time.perf_counter()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        connection.request(method, path, payload, headers)
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status = 0
+    finally:
+        connection.close()
+    return status, time.perf_counter() - started
+
+
+# Nearest-rank percentile of sorted values
+def percentile(values, p):
+    if not values:
+        return None
+    rank = max(math.ceil(p / 100.0 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    errors = sum(1 for status in statuses if not 200 <= status < 400)
+    status_codes = {}
+    for status in statuses:
+        status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'status_codes': status_codes,
+        'throughput_rps': round(len(latencies) / elapsed, 2)
+        if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3)
+        if latencies else None
+    }
+    for p in PERCENTILES:
+        value = percentile(latencies, p)
+        summary[f'p{p}_ms'] = round(value * 1000, 3) \
+            if value is not None else None
+    return summary
+
+
+def run_scenario(port, method, build_request, tokens, requests,
+                 concurrency):
+    def one(i):
+        path, body = build_request()
+        return timed_request(port, method, path, body,
+                             tokens[i % len(tokens)])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    return summarize([latency for status, latency in results],
+                     [status for status, latency in results], elapsed)
+
+
+# Relative change of every metric against a previous report, in percent
+def compare(report, baseline):
+    changes = {}
+    for name, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if previous is None:
+            continue
+        changes[name] = {}
+        for metric in ['throughput_rps', 'mean_ms'] + \
+                [f'p{p}_ms' for p in PERCENTILES]:
+            if current.get(metric) is None or not previous.get(metric):
+                continue
+            changes[name][metric] = round(
+                (current[metric] - previous[metric]) / previous[metric]
+                * 100, 1)
+    return changes
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Load and latency benchmark of the Casting Agency API')
+    parser.add_argument('--database', help='database URL, defaults to a '
+                        'temporary SQLite file')
+    parser.add_argument('--actors', type=int, default=1000)
+    parser.add_argument('--movies', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--tokens', type=int, default=1,
+                        help='distinct bearer tokens, more tokens mean '
+                        'fewer token cache hits')
+    parser.add_argument('--endpoints', help='comma separated scenario '
+                        'names, all by default')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--compare', help='previous JSON report')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix='casting-benchmark-')
+    private_pem, jwks = generate_local_jwks(KID, bits=2048)
+    jwks_path = os.path.join(workdir, 'jwks.json')
+    with open(jwks_path, 'w') as jwks_file:
+        json.dump(jwks, jwks_file)
+    database = args.database or \
+        'sqlite:///' + os.path.join(workdir, 'benchmark.db')
+
+    # read by the app modules at import time
+    os.environ.update({
+        'DATABASE_URL': database,
+        'JWKS_FILE': jwks_path,
+        'AUTH0_DOMAIN': ISSUER_DOMAIN,
+        'API_AUDIENCE': AUDIENCE,
+        'ALGORITHMS': 'RS256'
+    })
+    from app import create_app
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database})
+    actor_ids, movie_ids, reserved, words = seed(
+        app, args.actors, args.movies, args.requests, args.seed)
+    tokens = [sign_token(private_pem, KID, PERMISSIONS,
+                         issuer=f'https://{ISSUER_DOMAIN}/',
+                         audience=AUDIENCE, subject=f'benchmark-{i}')
+              for i in range(args.tokens)]
+    scenarios = build_scenarios(actor_ids, movie_ids, reserved, words)
+    if args.endpoints:
+        names = args.endpoints.split(',')
+        unknown = set(names) - set(scenarios)
+        if unknown:
+            sys.exit('Unknown endpoints: ' + ', '.join(sorted(unknown)))
+        scenarios = {name: scenarios[name] for name in names}
+
+    server = start_server(app)
+    try:
+        endpoints = {}
+        for name, (method, build_request) in scenarios.items():
+            endpoints[name] = run_scenario(
+                server.server_port, method, build_request, tokens,
+                args.requests, args.concurrency)
+    finally:
+        server.shutdown()
+
+    report = {
+        'config': {
+            'database': make_url(database).get_backend_name(),
+            'actors': args.actors,
+            'movies': args.movies,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'tokens': args.tokens,
+            'seed': args.seed,
+            'python': platform.python_version()
+        },
+        'endpoints': endpoints
+    }
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            report['change_percent'] = compare(report,
+                                               json.load(baseline_file))
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    print(output)
+    return report
+
+
+if __name__ == '__main__':
+    main()
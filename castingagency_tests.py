@@ -1,11 +1,37 @@
 import unittest
-from app import app
+from app import app, create_app, warmup
 from models.dbmodel import setup_db, db_drop_and_create_all, db, Actor, Movie
+from models.dbmodel import touch_table, get_table_version
+import csv
+import io
 import json
 import os
+import tempfile
+import time
 from faker import Faker
 import random
+from jose import jwt
 import app_utils
+from auth.auth import AuthError, requires_auth, token_cache
+from auth.jwks import JWKSKeyStore, KeySetUnavailable, verify_signature
+from auth.local_keys import generate_local_jwks
+import benchmark
+import manage
+import app_json
+import admission
+import compression
+import gzip
+import threading
+from models.rows import ActorRow, select_rows, iter_rows
+from models.importer import Importer, ImportAborted, ImportState
+from auth.token_cache import VerifiedTokenCache
+from models.cache import response_cache, entity_cache
+from models.pool import engine_options, pool_stats, pool_status
+from models.pool import TimedQueuePool
+from models.query_stats import QueryBudgetExceeded, statement_shape
+from models.stats import get_stats, recompute_stats, apply_deltas
+from sqlalchemy import create_engine, event, exc
+from prometheus_client import REGISTRY
 
 # for cloud deployments - change test_db_url in setup.sh file.
 DATABASE_PATH = os.getenv("TEST_DB_URL")
@@ -287,3 +313,1382 @@ class CastingAgencyTestCase(unittest.TestCase):
                                         headers=self.producer_header)
         data = json.loads(response.data)
         self.assertEqual(response.status_code, 200)
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    '''This class includes test cases for the in-process JWKS cache'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_pem, cls.jwks = generate_local_jwks()
+        jwks_file = tempfile.NamedTemporaryFile('w', suffix='.json',
+                                                delete=False)
+        json.dump(cls.jwks, jwks_file)
+        jwks_file.close()
+        cls.jwks_path = jwks_file.name
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.jwks_path)
+
+    def setUp(self):
+        self.store = JWKSKeyStore(path=self.jwks_path, ttl=3600,
+                                  min_refresh_interval=60)
+        self.loads = 0
+        load_document = self.store._load_document
+
+        def counting_load():
+            self.loads += 1
+            return load_document()
+        self.store._load_document = counting_load
+
+    # Testcase: keys are read once and served from memory afterwards
+    def test_key_set_is_cached(self):
+        for i in range(10):
+            self.assertIsNotNone(self.store.get_key('local-test-key'))
+        self.assertEqual(self.loads, 1)
+
+    # Testcase: unknown kid forces a refresh, but not more than once
+    # per min_refresh_interval
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        self.store.get_key('local-test-key')
+        self.store._attempted_at -= 60
+        self.assertIsNone(self.store.get_key('rotated-key'))
+        self.assertIsNone(self.store.get_key('rotated-key'))
+        self.assertEqual(self.loads, 2)
+
+    # Testcase: expired key set is served while refreshing in background
+    def test_stale_keys_served_when_refresh_fails(self):
+        self.store.get_key('local-test-key')
+        self.store._fetched_at -= 7200
+        self.store._attempted_at -= 7200
+
+        def failing_load():
+            self.loads += 1
+            raise OSError('jwks endpoint unavailable')
+        self.store._load_document = failing_load
+        self.assertIsNotNone(self.store.get_key('local-test-key'))
+        for i in range(50):
+            if not self.store._refreshing.locked():
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.loads, 2)
+        self.assertIsNotNone(self.store.get_key('local-test-key'))
+
+    # Testcase: requests are not blocked by a slow background refresh
+    def test_background_refresh_does_not_block(self):
+        self.store.get_key('local-test-key')
+        self.store._fetched_at -= 7200
+        self.store._attempted_at -= 7200
+        load_document = self.store._load_document
+
+        def slow_load():
+            time.sleep(0.5)
+            return load_document()
+        self.store._load_document = slow_load
+        started = time.monotonic()
+        for i in range(5):
+            self.assertIsNotNone(self.store.get_key('local-test-key'))
+        self.assertLess(time.monotonic() - started, 0.2)
+        self.assertTrue(self.store._refreshing.locked())
+        self.store._refreshing.acquire(timeout=2)
+        self.assertEqual(self.loads, 2)
+
+    # Testcase: a failed first load is retried once per
+    # min_refresh_interval, other requests fail fast meanwhile
+    def test_failed_initial_load_is_rate_limited(self):
+        def failing_load():
+            self.loads += 1
+            raise OSError('jwks endpoint unavailable')
+        self.store._load_document = failing_load
+        with self.assertRaises(OSError):
+            self.store.get_key('local-test-key')
+        for i in range(3):
+            with self.assertRaises(KeySetUnavailable):
+                self.store.get_key('local-test-key')
+        self.assertEqual(self.loads, 1)
+        self.store._attempted_at -= 60
+        with self.assertRaises(OSError):
+            self.store.get_key('local-test-key')
+        self.assertEqual(self.loads, 2)
+
+    # Testcase: signature verification with the pre-parsed key
+    def test_verify_signature_with_cached_key(self):
+        token = jwt.encode({'sub': 'tester'}, self.private_pem,
+                           algorithm='RS256',
+                           headers={'kid': 'local-test-key'})
+        key = self.store.get_key('local-test-key')
+        self.assertTrue(verify_signature(token, key, ['RS256']))
+        tampered = token[:-4] + ('AAAA' if token[-4:] != 'AAAA' else 'BBBB')
+        with self.assertRaises(Exception):
+            verify_signature(tampered, key, ['RS256'])
+        with self.assertRaises(Exception):
+            verify_signature(token, key, ['HS256'])
+
+
+class VerifiedTokenCacheTestCase(unittest.TestCase):
+    '''This class includes test cases for the verified token cache'''
+
+    def setUp(self):
+        self.cache = VerifiedTokenCache(maxsize=2)
+        self.payload = {
+            'sub': 'tester',
+            'exp': time.time() + 60,
+            'permissions': ['get:actors', 'get:movie']
+        }
+
+    def tearDown(self):
+        token_cache.clear()
+
+    # Testcase: hit/miss counters and precomputed permissions
+    def test_hit_and_miss_counters(self):
+        self.assertIsNone(self.cache.get('token'))
+        self.cache.put('token', self.payload)
+        entry = self.cache.get('token')
+        self.assertEqual(entry.permissions,
+                         frozenset(['get:actors', 'get:movie']))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    # Testcase: entries are dropped once the token expires
+    def test_expired_token_is_not_served(self):
+        self.payload['exp'] = time.time() - 1
+        self.cache.put('token', self.payload)
+        self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    # Testcase: least recently used token is evicted
+    def test_cache_is_bounded(self):
+        for token in ('a', 'b'):
+            self.cache.put(token, self.payload)
+        self.cache.get('a')
+        self.cache.put('c', self.payload)
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+
+    # Testcase: cached token is authorized without verifying it again
+    def test_requires_auth_serves_cached_token(self):
+        token_cache.put('cached-token', self.payload)
+
+        @requires_auth('get:actors')
+        def allowed(jwt):
+            return jwt['sub']
+
+        @requires_auth('delete:actors')
+        def denied(jwt):
+            return jwt['sub']
+
+        headers = {'Authorization': 'Bearer cached-token'}
+        with app.test_request_context('/actors', headers=headers):
+            self.assertEqual(allowed(), 'tester')
+            with self.assertRaises(AuthError) as context:
+                denied()
+            self.assertEqual(context.exception.status_code, 401)
+        self.assertEqual(token_cache.stats()['misses'], 0)
+
+
+class OfflineTestCase(unittest.TestCase):
+    '''Base class for endpoint tests against a local sqlite database,
+    authorized through pre-verified tokens in the token cache'''
+
+    permissions = ['add:actors', 'add:movie', 'delete:actors',
+                   'delete:movie', 'get:actors', 'get:movie',
+                   'modify:actors', 'modify:movie']
+
+    def setUp(self):
+        self.app = app
+        self.client = self.app.test_client
+        self.db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.db_file.close()
+        setup_db(app=self.app,
+                 database_path='sqlite:///' + self.db_file.name)
+        # every request of the offline tests must stay within the budget
+        self.app.config.update(QUERY_ACCOUNTING=True,
+                               QUERY_BUDGET_STRICT=True, TESTING=True)
+        with self.app.app_context():
+            db.drop_all()
+            db.create_all()
+            self.prepare_test_bed()
+        token_cache.put('offline-token', {
+            'sub': 'offline-tester',
+            'exp': time.time() + 600,
+            'permissions': self.permissions
+        })
+        self.headers = {'Authorization': 'Bearer offline-token'}
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+        token_cache.clear()
+        response_cache.invalidate()
+        entity_cache.invalidate()
+        os.remove(self.db_file.name)
+
+    def prepare_test_bed(self):
+        for i in range(20):
+            actor = Actor(name=fake.name(),
+                          gender=app_utils.get_gender_char(),
+                          age=random.randint(18, 99),
+                          identifier=app_utils.generate_guid())
+            db.session.add(actor)
+        for i in range(8):
+            movie = Movie(title=fake.sentence(nb_words=3),
+                          identifier=app_utils.generate_guid(),
+                          release_date=app_utils.get_datetime(
+                              "29/06/20{:02d}".format(15 + i)),
+                          production_house="Marvel Studios",
+                          ott_partner="Hotstar Disney+")
+            db.session.add(movie)
+        db.session.commit()
+
+
+class PaginationTestCase(OfflineTestCase):
+    '''This class includes test cases for SQL level pagination'''
+
+    # Testcase: default page size and page metadata
+    def test_first_page_of_actors(self):
+        response = self.client().get("/actors", headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['actors']), 6)
+        self.assertEqual(data['total'], 20)
+        self.assertEqual(data['next_page'], 2)
+        self.assertEqual([actor['id'] for actor in data['actors']],
+                         list(range(1, 7)))
+
+    # Testcase: last page has no next page
+    def test_last_page_of_movies(self):
+        response = self.client().get("/movies?page=2&per_page=5",
+                                     headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['actors']), 3)
+        self.assertIsNone(data['next_page'])
+
+    # Testcase: per_page is capped
+    def test_per_page_is_capped(self):
+        response = self.client().get("/actors?per_page=1000",
+                                     headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['per_page'], 100)
+        self.assertEqual(len(data['actors']), 20)
+
+    # Testcase(Negative): invalid page number
+    def test_invalid_page(self):
+        response = self.client().get("/actors?page=0",
+                                     headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    # Testcase: walking all pages with the cursor returns every row once
+    def test_cursor_walks_every_actor(self):
+        seen = []
+        url = "/actors?sort=-name&per_page=7"
+        response = self.client().get(url, headers=self.headers)
+        data = json.loads(response.data)
+        seen.extend(data['actors'])
+        while data['next_cursor']:
+            response = self.client().get(
+                url + "&cursor=" + data['next_cursor'], headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            seen.extend(data['actors'])
+        self.assertEqual(len(seen), 20)
+        self.assertEqual(len(set(actor['id'] for actor in seen)), 20)
+        names = [(actor['name'], actor['id']) for actor in seen]
+        self.assertEqual(names, sorted(names, reverse=True))
+
+    # Testcase: cursor over movies sorted by release date
+    def test_cursor_by_release_date(self):
+        response = self.client().get("/movies?sort=release_date&per_page=3",
+                                     headers=self.headers)
+        data = json.loads(response.data)
+        response = self.client().get(
+            "/movies?sort=release_date&per_page=3&cursor="
+            + data['next_cursor'], headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual([movie['release_date'] for movie in data['actors']],
+                         ['29/06/2018', '29/06/2019', '29/06/2020'])
+
+    # Testcase(Negative): cursor issued for another sort order
+    def test_cursor_for_other_sort_is_rejected(self):
+        response = self.client().get("/actors?per_page=2",
+                                     headers=self.headers)
+        cursor = json.loads(response.data)['next_cursor']
+        response = self.client().get("/actors?sort=name&cursor=" + cursor,
+                                     headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client().get("/actors?cursor=not-a-cursor",
+                                     headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkCreateTestCase(OfflineTestCase):
+    '''This class includes test cases for the bulk create endpoints'''
+
+    # Testcase: valid items are created, invalid ones reported per item
+    def test_bulk_create_actors(self):
+        actors = [{"name": fake.name(), "age": 30, "gender": "female"}
+                  for i in range(1200)]
+        actors[3] = {"name": "", "age": 30, "gender": "male"}
+        actors[7] = {"name": fake.name(), "age": "old", "gender": "male"}
+        response = self.client().post("/actors/bulk", json=actors,
+                                      headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data['created'], data['failed']), (1198, 2))
+        self.assertIn('error', data['results'][3])
+        self.assertEqual(data['results'][8]['id'], 27)
+        with self.app.app_context():
+            actor = Actor.query.get(data['results'][8]['id'])
+            self.assertEqual(actor.identifier,
+                             data['results'][8]['identifier'])
+            self.assertEqual(actor.gender, 'F')
+            self.assertEqual(Actor.query.count(), 1218)
+
+    # Testcase: movies sent as NDJSON
+    def test_bulk_create_movies_ndjson(self):
+        lines = [
+            json.dumps({"title": "Dhoom", "release_date": "27/08/2004"}),
+            "{not json",
+            json.dumps({"title": "Dhoom 2", "release_date": "2006-11-24"}),
+            json.dumps({"title": "Dhoom 3", "release_date": "20/12/2013",
+                        "ott_partner": "Prime Video"})
+        ]
+        response = self.client().post(
+            "/movies/bulk", data="\n".join(lines),
+            content_type="application/x-ndjson", headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([('id' in result) for result in data['results']],
+                         [True, False, False, True])
+
+    # Testcase(Negative): body is not a list
+    def test_bulk_create_rejects_object(self):
+        response = self.client().post("/actors/bulk",
+                                      json={"name": fake.name()},
+                                      headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTestCase(OfflineTestCase):
+    '''This class includes test cases for the streaming exports'''
+
+    # Testcase: every actor is exported as one NDJSON line
+    def test_export_actors_ndjson(self):
+        response = self.client().get("/actors/export", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line)
+                for line in response.data.decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], list(range(1, 21)))
+
+    # Testcase: CSV export with since and filter parameters
+    def test_export_movies_csv(self):
+        response = self.client().get(
+            "/movies/export?format=csv&since=5"
+            "&production_house=Marvel%20Studios", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+        self.assertEqual([row['id'] for row in rows], ['6', '7', '8'])
+        self.assertEqual(rows[0]['release_date'], '29/06/2020')
+
+    # Testcase(Negative): unknown export format
+    def test_export_unknown_format(self):
+        response = self.client().get("/actors/export?format=xml",
+                                     headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTestCase(OfflineTestCase):
+    '''This class includes test cases for ETags and the response cache'''
+
+    def conditional_get(self, url, etag):
+        headers = dict(self.headers)
+        headers['If-None-Match'] = '"{}"'.format(etag)
+        return self.client().get(url, headers=headers)
+
+    # Testcase: table versions are seeded, and tables without a version
+    # row get one on their first write
+    def test_table_versions(self):
+        with self.app.app_context():
+            db_drop_and_create_all()
+            self.assertEqual(get_table_version('castings'), 1)
+            touch_table('castings')
+            touch_table('unversioned')
+            touch_table('unversioned')
+            db.session.commit()
+            self.assertEqual(get_table_version('castings'), 2)
+            self.assertEqual(get_table_version('unversioned'), 2)
+
+    # Testcase: unchanged list page is answered with 304
+    def test_list_not_modified(self):
+        response = self.client().get("/actors", headers=self.headers)
+        etag = response.get_etag()[0]
+        response = self.conditional_get("/actors", etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.conditional_get("/actors?page=2", etag)
+        self.assertEqual(response.status_code, 200)
+
+    # Testcase: serialized page is cached and dropped on update
+    def test_list_cache_invalidated_on_update(self):
+        first = self.client().get("/movies", headers=self.headers)
+        hits = response_cache.stats()['hits']
+        second = self.client().get("/movies", headers=self.headers)
+        self.assertEqual(response_cache.stats()['hits'], hits + 1)
+        self.assertEqual(first.data, second.data)
+        self.client().patch("/movies/1", json={'ott_partner': 'Netflix'},
+                            headers=self.headers)
+        response = self.conditional_get("/movies", first.get_etag()[0])
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['actors'][0]['ott_partner'], 'Netflix')
+
+    # Testcase: entity ETag changes with the row version
+    def test_entity_not_modified(self):
+        response = self.client().get("/actors/3", headers=self.headers)
+        etag = response.get_etag()[0]
+        self.assertEqual(self.conditional_get("/actors/3", etag).status_code,
+                         304)
+        # the test bed ages are 18-99, an unchanged age would not bump the
+        # row version
+        self.client().patch("/actors/3", json={'age': 17},
+                            headers=self.headers)
+        response = self.conditional_get("/actors/3", etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+
+
+class EntityCacheTestCase(OfflineTestCase):
+    '''This class includes test cases for the actor and movie cache'''
+
+    # Testcase: second lookup is served from the cache
+    def test_repeated_lookup_hits_cache(self):
+        hits = entity_cache.stats()['hits']
+        first = self.client().get("/movies/2", headers=self.headers)
+        second = self.client().get("/movies/2", headers=self.headers)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(entity_cache.stats()['hits'], hits + 1)
+
+    # Testcase: update and delete drop the cached entity
+    def test_writes_invalidate_cache(self):
+        self.client().get("/actors/4", headers=self.headers)
+        self.client().patch("/actors/4", json={'name': 'Renamed Actor'},
+                            headers=self.headers)
+        response = self.client().get("/actors/4", headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['actor_details']['name'], 'Renamed Actor')
+        self.client().delete("/actors/4", headers=self.headers)
+        response = self.client().get("/actors/4", headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    # Testcase: an entry of an older row version is not served, e.g. after
+    # an update by another worker
+    def test_stale_version_is_a_miss(self):
+        first = self.client().get("/actors/5", headers=self.headers)
+        with self.app.app_context():
+            db.session.execute(Actor.__table__.update()
+                               .where(Actor.id == 5)
+                               .values(name='Changed Elsewhere',
+                                       version=Actor.version + 1))
+            db.session.commit()
+        response = self.client().get("/actors/5", headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['actor_details']['name'], 'Changed Elsewhere')
+        self.assertNotEqual(response.get_etag(), first.get_etag())
+
+
+class FilterTestCase(OfflineTestCase):
+    '''This class includes test cases for list filters and sorting'''
+
+    # Testcase: gender and age range filter with sorting by age
+    def test_filter_actors_by_gender_and_age(self):
+        with self.app.app_context():
+            expected = Actor.query.filter(Actor.gender == 'F',
+                                          Actor.age >= 25,
+                                          Actor.age <= 60).count()
+        response = self.client().get(
+            "/actors?gender=female&min_age=25&max_age=60&sort=age"
+            "&per_page=100", headers=self.headers)
+        if expected == 0:
+            self.assertEqual(response.status_code, 404)
+            return
+        data = json.loads(response.data)
+        self.assertEqual(data['total'], expected)
+        ages = [actor['age'] for actor in data['actors']]
+        self.assertEqual(ages, sorted(ages))
+        self.assertTrue(all(25 <= age <= 60 for age in ages))
+        self.assertTrue(all(actor['gender'] == 'Female'
+                            for actor in data['actors']))
+
+    # Testcase: release date range and title prefix
+    def test_filter_movies(self):
+        with self.app.app_context():
+            movie = Movie.query.get(3)
+            movie.title = '100% Love'
+            movie.update()
+        response = self.client().get(
+            "/movies?released_after=01/01/2017&released_before=31/12/2020"
+            "&sort=-release_date", headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual([movie['id'] for movie in data['actors']],
+                         [6, 5, 4, 3])
+        response = self.client().get("/movies?title=100%25",
+                                     headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual([movie['id'] for movie in data['actors']], [3])
+        response = self.client().get("/movies?title=10_",
+                                     headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    # Testcase(Negative): malformed filter values
+    def test_invalid_filters(self):
+        for url in ("/actors?min_age=young", "/movies?released_after=2020",
+                    "/actors?sort=gender"):
+            response = self.client().get(url, headers=self.headers)
+            self.assertEqual(response.status_code, 400)
+
+
+class SearchTestCase(OfflineTestCase):
+    '''This class includes test cases for the full-text search'''
+
+    def prepare_test_bed(self):
+        super().prepare_test_bed()
+        db.session.add(Actor(name="Robert Downey", age=55, gender='M',
+                             identifier=app_utils.generate_guid()))
+        db.session.add(Movie(title="Downey in Robert Land",
+                             release_date=app_utils.get_datetime("01/01/2020"),
+                             identifier=app_utils.generate_guid()))
+        db.session.commit()
+
+    # Testcase: actors and movies are ranked together, prefixes match
+    def test_search_actors_and_movies(self):
+        response = self.client().get("/search?q=robert%20down",
+                                     headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        found = [(result['type'], result['details']['id'])
+                 for result in data['results']]
+        self.assertIn(('actor', 21), found)
+        self.assertIn(('movie', 9), found)
+
+    # Testcase: index follows updates and deletes
+    def test_search_index_in_sync(self):
+        self.client().patch("/actors/21", json={'name': 'Tony Zyxwquark'},
+                            headers=self.headers)
+        response = self.client().get("/search?q=zyxwquark&type=actor",
+                                     headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual([result['details']['id']
+                          for result in data['results']], [21])
+        self.client().delete("/actors/21", headers=self.headers)
+        response = self.client().get("/search?q=zyxwquark",
+                                     headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    # Testcase(Negative): query without words, unknown type
+    def test_invalid_search(self):
+        for url in ("/search", "/search?q=robert&type=studio"):
+            response = self.client().get(url, headers=self.headers)
+            self.assertEqual(response.status_code, 400)
+
+
+class IdentifierTestCase(OfflineTestCase):
+    '''This class includes test cases for lookups by identifier'''
+
+    # Testcase: identifiers are time ordered version 7 UUIDs
+    def test_generated_identifiers_are_time_ordered(self):
+        identifiers = []
+        for i in range(3):
+            identifiers.append(app_utils.generate_guid())
+            time.sleep(0.002)
+        self.assertEqual(identifiers, sorted(identifiers))
+        self.assertTrue(all(identifier[14] == '7'
+                            for identifier in identifiers))
+
+    # Testcase: actor created through the API is found by identifier
+    def test_get_actor_by_identifier(self):
+        response = self.client().post("/actors", json={
+            "name": "Ravi Kumar", "age": 30, "gender": "male"
+        }, headers=self.headers)
+        identifier = json.loads(response.data)['identifier']
+        response = self.client().get("/actors/by-identifier/" + identifier,
+                                     headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['actor_details']['identifier'], identifier)
+        self.assertEqual(data['actor_details']['name'], "Ravi Kumar")
+
+    # Testcase: movie lookup, unknown and malformed identifiers
+    def test_get_movie_by_identifier(self):
+        with self.app.app_context():
+            identifier = Movie.query.get(2).identifier
+        response = self.client().get("/movies/by-identifier/" + identifier,
+                                     headers=self.headers)
+        self.assertEqual(json.loads(response.data)['movie_details']['id'], 2)
+        response = self.client().get(
+            "/movies/by-identifier/" + app_utils.generate_guid(),
+            headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        response = self.client().get("/movies/by-identifier/not-a-uuid",
+                                     headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+
+class AppFactoryTestCase(unittest.TestCase):
+    '''This class includes test cases for the application factory'''
+
+    def setUp(self):
+        self.db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.db_file.close()
+        os.remove(self.db_file.name)
+        self.database_path = 'sqlite:///' + self.db_file.name
+
+    def tearDown(self):
+        if os.path.exists(self.db_file.name):
+            os.remove(self.db_file.name)
+
+    # Testcase: creating the app does not create the database
+    def test_create_app_has_no_side_effects(self):
+        factory_app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path
+        })
+        self.assertFalse(os.path.exists(self.db_file.name))
+        self.assertIn('api.get_all_actors', factory_app.view_functions)
+
+    # Testcase: tables are only created on request, warmup connects
+    def test_create_tables_and_warmup(self):
+        factory_app = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'CREATE_TABLES': True,
+            'WARMUP_CONNECTIONS': 1
+        })
+        warmup(factory_app)
+        with factory_app.app_context():
+            self.assertEqual(Actor.query.count(), 0)
+            db.session.remove()
+            db.get_engine(factory_app).dispose()
+
+
+class PoolTestCase(OfflineTestCase):
+    '''This class includes test cases for pool configuration and stats'''
+
+    # Testcase: sizing options only apply to server databases
+    def test_engine_options(self):
+        options = engine_options('postgresql://localhost/casting')
+        self.assertIs(options['poolclass'], TimedQueuePool)
+        self.assertIn('pool_size', options)
+        self.assertTrue(options['pool_pre_ping'])
+        options = engine_options('sqlite:///casting.db')
+        self.assertNotIn('pool_size', options)
+        self.assertNotIn('poolclass', options)
+
+    # Testcase: checkouts and wait times of a QueuePool are recorded
+    def test_timed_queue_pool(self):
+        pool_stats.reset()
+        engine = create_engine('sqlite:///' + self.db_file.name,
+                               poolclass=TimedQueuePool, pool_size=1,
+                               max_overflow=0, pool_timeout=0.05)
+        connection = engine.connect()
+        status = pool_status(engine)
+        self.assertEqual(status['checked_out'], 1)
+        self.assertEqual(status['checkouts'], 1)
+        with self.assertRaises(exc.TimeoutError):
+            engine.connect()
+        connection.close()
+        status = pool_status(engine)
+        self.assertEqual(status['checked_out'], 0)
+        self.assertEqual(status['timeouts'], 1)
+        self.assertGreaterEqual(status['wait_seconds_max'], 0.05)
+        engine.dispose()
+
+    # Testcase: pool status endpoint
+    def test_database_health(self):
+        response = self.client().get("/health/db")
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertIn('checkouts', data['pool'])
+
+
+class MetricsTestCase(OfflineTestCase):
+    '''This class includes test cases for the /metrics endpoint'''
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    # Testcase: requests are counted per route template and status
+    def test_request_metrics(self):
+        labels = {'method': 'GET', 'route': '/actors/<int:actor_id>',
+                  'status': '404'}
+        before = self.sample('casting_http_requests_total', **labels)
+        self.client().get("/actors/1000", headers=self.headers)
+        self.assertEqual(
+            self.sample('casting_http_requests_total', **labels), before + 1)
+        self.assertGreater(self.sample(
+            'casting_http_request_duration_seconds_count',
+            method='GET', route='/actors/<int:actor_id>'), 0)
+
+    # Testcase: JWT, database and serialization timers are exported
+    def test_timers(self):
+        cached = self.sample('casting_jwt_verification_seconds_count',
+                             source='cache')
+        self.client().get("/actors/1", headers=self.headers)
+        self.assertEqual(self.sample(
+            'casting_jwt_verification_seconds_count', source='cache'),
+            cached + 1)
+        response = self.client().get("/metrics")
+        body = response.data.decode('utf-8')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn('casting_db_statement_seconds_count', body)
+        self.assertIn('casting_json_serialization_seconds_count', body)
+
+    # Testcase: verified token cache hits and misses are counted
+    def test_token_cache_lookups(self):
+        hits = self.sample('casting_token_cache_lookups_total', result='hit')
+        misses = self.sample('casting_token_cache_lookups_total',
+                             result='miss')
+        self.client().get("/actors/1", headers=self.headers)
+        self.client().get("/actors/1", headers={
+            'Authorization': 'Bearer unknown-token'})
+        self.assertEqual(self.sample('casting_token_cache_lookups_total',
+                                     result='hit'), hits + 1)
+        self.assertEqual(self.sample('casting_token_cache_lookups_total',
+                                     result='miss'), misses + 1)
+
+
+class QueryAccountingTestCase(OfflineTestCase):
+    '''This class includes test cases for per request query accounting'''
+
+    # Testcase: query count and timing headers
+    def test_query_headers(self):
+        response = self.client().get("/actors/1", headers=self.headers)
+        self.assertGreater(int(response.headers['X-Query-Count']), 0)
+        self.assertIn('db;dur=', response.headers['Server-Timing'])
+
+    # Testcase: expanded IN lists and literals share one shape
+    def test_statement_shape(self):
+        self.assertEqual(
+            statement_shape("SELECT * FROM actors WHERE id IN (?, ?, ?)"),
+            statement_shape("SELECT * FROM actors\nWHERE id IN (?)"))
+        self.assertEqual(
+            statement_shape("SELECT * FROM actors WHERE age = 30"),
+            statement_shape("SELECT * FROM actors WHERE age = 31"))
+
+    # Testcase(Negative): budget and repeated statements fail the request
+    def test_query_budget(self):
+        self.app.config['QUERY_BUDGET'] = 0
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client().get("/actors/1", headers=self.headers)
+        self.app.config['QUERY_BUDGET'] = 20
+        self.app.config['QUERY_REPEAT_LIMIT'] = 0
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client().get("/actors/2", headers=self.headers)
+
+    def tearDown(self):
+        self.app.config.update(QUERY_BUDGET=20, QUERY_REPEAT_LIMIT=5)
+        super().tearDown()
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    '''This class includes test cases for the benchmark report helpers'''
+
+    # Testcase: nearest-rank percentiles and error counting
+    def test_summarize(self):
+        latencies = [i / 1000.0 for i in range(1, 101)]
+        summary = benchmark.summarize(latencies, [200] * 99 + [500], 2.0)
+        self.assertEqual(summary['p50_ms'], 50.0)
+        self.assertEqual(summary['p95_ms'], 95.0)
+        self.assertEqual(summary['p99_ms'], 99.0)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['throughput_rps'], 50.0)
+
+    # Testcase: reports are compared per endpoint in percent
+    def test_compare(self):
+        baseline = {'endpoints': {'get_actor': {'p95_ms': 10.0}}}
+        report = {'endpoints': {'get_actor': {'p95_ms': 12.5},
+                                'search': {'p95_ms': 3.0}}}
+        self.assertEqual(benchmark.compare(report, baseline),
+                         {'get_actor': {'p95_ms': 25.0}})
+
+
+class JSONEncodingTestCase(OfflineTestCase):
+    '''This class includes test cases for the response encoder'''
+
+    # Testcase: dates are written in the API format by the encoder
+    def test_movie_release_date(self):
+        response = self.client().get("/movies/1", headers=self.headers)
+        data = json.loads(response.data)
+        with self.app.app_context():
+            release_date = Movie.query.get(1).release_date
+        self.assertEqual(data['movie_details']['release_date'],
+                         release_date.strftime('%d/%m/%Y'))
+
+    # Testcase: orjson and the standard library produce the same document
+    def test_encoders_agree(self):
+        document = {'b': [1, 2.5, None], 'a': app_utils.get_datetime(
+            '29/06/2020'), 'name': 'R\u00e9ka'}
+        encoded = app_json.APIJSONEncoder(sort_keys=True).encode(document)
+        self.assertEqual(json.loads(encoded), {
+            'a': '29/06/2020', 'b': [1, 2.5, None], 'name': 'R\u00e9ka'})
+        self.assertEqual(json.loads(app_json.dumps(document)),
+                         json.loads(encoded))
+
+
+class RowReadPathTestCase(OfflineTestCase):
+    '''This class includes test cases for the read-only row path'''
+
+    # Testcase: rows format exactly like the ORM entities
+    def test_rows_match_entities(self):
+        with self.app.app_context():
+            for model in (Actor, Movie):
+                query = model.query.order_by(model.id)
+                self.assertEqual(
+                    [row.format() for row in select_rows(model, query)],
+                    [entity.format() for entity in query])
+
+    # Testcase: streamed rows are slotted tuples in query order
+    def test_iter_rows(self):
+        with self.app.app_context():
+            query = Actor.query.filter(Actor.id > 5).order_by(Actor.id)
+            rows = list(iter_rows(Actor, query, batch_size=4))
+        self.assertEqual([row.id for row in rows], list(range(6, 21)))
+        self.assertIsInstance(rows[0], ActorRow)
+        self.assertFalse(hasattr(rows[0], '__dict__'))
+
+
+class ImportTestCase(OfflineTestCase):
+    '''This class includes test cases for the bulk import command'''
+
+    def write_file(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as import_file:
+            import_file.write(content)
+        self.addCleanup(ImportState(path).remove)
+        self.addCleanup(os.remove, path)
+        return path
+
+    # Testcase: CSV import in batches, invalid rows are reported
+    def test_import_csv(self):
+        path = self.write_file('.csv', 'name,age,gender\n'
+                               'Ravi Kumar,30,male\n'
+                               'Nobody,old,male\n'
+                               'Asha Rao,25,female\n'
+                               'Ira Sen,41,female\n')
+        with self.app.app_context():
+            summary = Importer('actors', path, batch_size=2,
+                               report=lambda message: None).run()
+            self.assertEqual(Actor.query.count(), 23)
+            self.assertEqual(Actor.query.get(23).name, 'Ira Sen')
+        self.assertEqual(summary['imported'], 3)
+        self.assertEqual(summary['errors'],
+                         [{'line': 3, 'error': 'age must be a positive '
+                                               'integer'}])
+
+    # Testcase: JSONL movies keep their identifiers
+    def test_import_jsonl(self):
+        identifier = app_utils.generate_guid()
+        path = self.write_file('.jsonl', json.dumps({
+            'title': 'Ek Tha Tiger', 'release_date': '29/06/2020',
+            'identifier': identifier}) + '\n{broken\n')
+        with self.app.app_context():
+            summary = Importer('movies', path,
+                               report=lambda message: None).run()
+            movie = Movie.query.filter(Movie.identifier == identifier).one()
+            self.assertEqual(movie.release_date.day, 29)
+        self.assertEqual(summary['imported'], 1)
+        self.assertEqual(len(summary['errors']), 1)
+
+    # Testcase: resume skips committed lines, a committed pending batch
+    # is detected by its last identifier
+    def test_resume(self):
+        lines = [json.dumps({'name': f'Actor {i}', 'age': 20 + i,
+                             'gender': 'male'}) for i in range(4)]
+        path = self.write_file('.jsonl', '\n'.join(lines) + '\n')
+        with self.app.app_context():
+            with self.assertRaises(ImportAborted):
+                ImportState(path).save(kind='actors', line=2, imported=2,
+                                       pending=None)
+                Importer('actors', path).run()
+            summary = Importer('actors', path,
+                               report=lambda message: None).run(resume=True)
+            self.assertEqual(summary['new_rows'], 2)
+            self.assertEqual(Actor.query.get(22).name, 'Actor 3')
+            identifier = Actor.query.get(22).identifier
+            ImportState(path).save(kind='actors', line=2, imported=2,
+                                   pending={'line': 4, 'rows': 2,
+                                            'identifier': identifier})
+            summary = Importer('actors', path,
+                               report=lambda message: None).run(resume=True)
+            self.assertEqual(summary['new_rows'], 0)
+            self.assertEqual(summary['imported'], 4)
+        self.assertFalse(os.path.exists(ImportState(path).path))
+
+
+class CastingTestCase(OfflineTestCase):
+    '''This class includes test cases for cast and filmography endpoints'''
+
+    def cast(self, movie_id, actor_id, **data):
+        data['actor_id'] = actor_id
+        return self.client().post(f"/movies/{movie_id}/cast", json=data,
+                                  headers=self.headers)
+
+    # Testcase: actors are listed in billing order with their roles
+    def test_add_and_get_cast(self):
+        self.cast(1, 3, role='Villain', billing_order=2)
+        response = self.cast(1, 5, role='Lead', billing_order=1)
+        self.assertEqual(json.loads(response.data)['billing_order'], 1)
+        response = self.client().get("/movies/1/cast", headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(member['actor']['id'], member['role'])
+                          for member in data['cast']],
+                         [(5, 'Lead'), (3, 'Villain')])
+
+    # Testcase(Negative): unknown actor, duplicate casting, bad body
+    def test_invalid_cast(self):
+        self.assertEqual(self.cast(1, 1000).status_code, 404)
+        self.assertEqual(self.cast(1, 2).status_code, 200)
+        self.assertEqual(self.cast(1, 2).status_code, 422)
+        response = self.client().post("/movies/1/cast", json={
+            'actor_id': 'two'}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    # Testcase(Negative): booleans are not accepted as ids or billing order
+    def test_boolean_cast_fields(self):
+        self.assertEqual(self.cast(1, True).status_code, 400)
+        self.assertEqual(self.cast(1, 2, billing_order=True).status_code, 400)
+        response = self.client().get("/movies/1/cast", headers=self.headers)
+        self.assertEqual(json.loads(response.data)['cast'], [])
+
+    # Testcase: removing a cast member and deleting a cast actor
+    def test_remove_cast(self):
+        self.cast(2, 4)
+        self.cast(2, 6)
+        response = self.client().delete("/movies/2/cast/4",
+                                        headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.client().delete("/actors/6", headers=self.headers)
+        response = self.client().get("/movies/2/cast", headers=self.headers)
+        self.assertEqual(json.loads(response.data)['cast'], [])
+        response = self.client().delete("/movies/2/cast/4",
+                                        headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    # Testcase: filmography, newest movie first
+    def test_filmography(self):
+        for movie_id in (1, 2, 3):
+            self.cast(movie_id, 7, role=f'Role {movie_id}')
+        response = self.client().get("/actors/7/filmography",
+                                     headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(data['actor']['id'], 7)
+        self.assertEqual([credit['movie']['id']
+                          for credit in data['filmography']], [3, 2, 1])
+
+    # Testcase: a page of movies with casts costs a constant number of
+    # queries, and the cached page follows cast changes
+    def test_movies_include_cast(self):
+        for movie_id in range(1, 9):
+            self.cast(movie_id, movie_id)
+            self.cast(movie_id, movie_id + 8)
+        response = self.client().get("/movies?include=cast&per_page=8",
+                                     headers=self.headers)
+        data = json.loads(response.data)
+        queries = int(response.headers['X-Query-Count'])
+        self.assertEqual([len(movie['cast']) for movie in data['actors']],
+                         [2] * 8)
+        self.client().delete("/movies/1/cast/1", headers=self.headers)
+        response = self.client().get("/movies?include=cast&per_page=8",
+                                     headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(len(data['actors'][0]['cast']), 1)
+        self.assertEqual(int(response.headers['X-Query-Count']), queries)
+
+
+class StatsTestCase(OfflineTestCase):
+    '''This class includes test cases for the catalogue statistics'''
+
+    def get_stats(self, headers=None):
+        response = self.client().get("/stats", headers=headers or self.headers)
+        return response, json.loads(response.data)
+
+    def recomputed(self):
+        with self.app.app_context():
+            counted = get_stats()
+            recompute_stats()
+            return counted, get_stats()
+
+    # Testcase: the counters of the seeded catalogue match a full recount
+    def test_stats_after_setup(self):
+        counted, recounted = self.recomputed()
+        self.assertEqual(counted, recounted)
+        response, data = self.get_stats()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['actors']['total'], 20)
+        self.assertEqual(sum(data['actors']['by_age'].values()), 20)
+        self.assertEqual(data['movies']['total'], 8)
+        self.assertEqual(data['movies']['by_production_house'],
+                         {'Marvel Studios': 8})
+        self.assertEqual(data['movies']['by_ott_partner'],
+                         {'Hotstar Disney+': 8})
+
+    # Testcase: updates move an actor between buckets, deletes decrement
+    def test_stats_follow_updates_and_deletes(self):
+        self.client().patch("/actors/1", json={"age": 12, "gender": "female"},
+                            headers=self.headers)
+        self.client().patch("/actors/2", json={"age": 12, "gender": "male"},
+                            headers=self.headers)
+        self.client().patch("/movies/1", json={"ott_partner": "Netflix"},
+                            headers=self.headers)
+        self.client().delete("/movies/2", headers=self.headers)
+        response, data = self.get_stats()
+        self.assertEqual(data['actors']['by_age']['0-17'], 2)
+        self.assertEqual(data['movies']['total'], 7)
+        self.assertEqual(data['movies']['by_ott_partner'],
+                         {'Hotstar Disney+': 6, 'Netflix': 1})
+        counted, recounted = self.recomputed()
+        self.assertEqual(counted, recounted)
+
+    # Testcase: bulk inserts are counted in their transaction
+    def test_stats_count_bulk_inserts(self):
+        movies = [{"title": fake.sentence(nb_words=3),
+                   "release_date": "01/01/2021", "production_house": "RK"}
+                  for i in range(5)]
+        self.client().post("/movies/bulk", json=movies, headers=self.headers)
+        response, data = self.get_stats()
+        self.assertEqual(data['movies']['total'], 13)
+        self.assertEqual(data['movies']['by_production_house']['RK'], 5)
+        self.assertEqual(data['movies']['by_ott_partner']['(none)'], 5)
+        counted, recounted = self.recomputed()
+        self.assertEqual(counted, recounted)
+
+    # Testcase: a bucket created by another transaction since is added to,
+    # not inserted twice
+    def test_apply_deltas_upserts(self):
+        key = ('movie_production_house', 'Yash Raj')
+        with self.app.app_context():
+            other = db.create_scoped_session()
+            apply_deltas(other, {key: 2})
+            other.commit()
+            other.remove()
+            apply_deltas(db.session, {key: 1, ('movie_ott_partner',
+                                               'Netflix'): 1})
+            db.session.commit()
+            stats = get_stats()
+        self.assertEqual(stats['movie_production_house']['Yash Raj'], 3)
+        self.assertEqual(stats['movie_ott_partner']['Netflix'], 1)
+
+    # Testcase: recompute_stats repairs counters of raw SQL changes
+    def test_recompute_stats_repairs_drift(self):
+        with self.app.app_context():
+            db.session.execute(Movie.__table__.delete()
+                               .where(Movie.id > 4))
+            db.session.commit()
+            recompute_stats()
+        response, data = self.get_stats()
+        self.assertEqual(data['movies']['total'], 4)
+        self.assertEqual(data['movies']['by_ott_partner'],
+                         {'Hotstar Disney+': 4})
+
+    # Testcase: manage.py imports and its recompute_stats command rebuilds
+    # the counters
+    def test_recompute_stats_command(self):
+        self.assertIn('recompute_stats', manage.manager._commands)
+        self.assertIn('create_db', manage.manager._commands)
+        with self.app.app_context():
+            db.session.execute(Actor.__table__.delete())
+            db.session.commit()
+            manage.RecomputeStatsCommand().run()
+        response, data = self.get_stats()
+        self.assertEqual(data['actors']['total'], 0)
+
+    # Testcase: sections the token may not read are left out
+    def test_stats_permissions(self):
+        token_cache.put('actors-token', {
+            'sub': 'actors-reader',
+            'exp': time.time() + 600,
+            'permissions': ['get:actors']
+        })
+        token_cache.put('no-read-token', {
+            'sub': 'writer',
+            'exp': time.time() + 600,
+            'permissions': ['add:actors']
+        })
+        response, data = self.get_stats(
+            {'Authorization': 'Bearer actors-token'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('actors', data)
+        self.assertNotIn('movies', data)
+        response, data = self.get_stats(
+            {'Authorization': 'Bearer no-read-token'})
+        self.assertEqual(response.status_code, 401)
+
+
+class AdmissionTestCase(unittest.TestCase):
+    '''This class includes test cases for admission control'''
+
+    def setUp(self):
+        self.db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.db_file.close()
+        self.app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_file.name,
+            'ADMISSION_MAX_CONCURRENCY': 1,
+            'ADMISSION_QUEUE_SIZE': 0,
+            'ADMISSION_RETRY_AFTER': 3
+        })
+        self.limiter = self.app.extensions['admission']
+
+    def tearDown(self):
+        os.remove(self.db_file.name)
+
+    # Queues waiters of the given priorities on limiter, in this order
+    def queue(self, limiter, priorities):
+        results = {}
+
+        def wait(priority):
+            try:
+                limiter.acquire(priority)
+                results[priority] = 'admitted'
+            except admission.AdmissionRejected as rejected:
+                results[priority] = rejected.reason
+
+        threads = []
+        for priority in priorities:
+            thread = threading.Thread(target=wait, args=(priority,))
+            thread.start()
+            threads.append(thread)
+            while thread.is_alive() and \
+                    priority not in [entry[0] for entry in limiter.queue]:
+                time.sleep(0.001)
+        return threads, results
+
+    # Testcase: a saturated worker answers 503 with Retry-After right
+    # away, health checks still pass
+    def test_saturated_worker_rejects(self):
+        self.limiter.acquire(admission.READ)
+        response = self.app.test_client().get("/actors")
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '3')
+        self.assertEqual(data['reason'], 'queue_full')
+        for path in ("/", "/health", "/status", "/health/db", "/metrics"):
+            self.assertEqual(self.app.test_client().get(path).status_code,
+                             200, path)
+        self.limiter.release()
+        self.assertEqual(self.limiter.status()['rejected'],
+                         {'queue_full': 1})
+        self.assertIn(b'casting_admission_rejections_total',
+                      self.app.test_client().get("/metrics").data)
+
+    # Testcase: admitted requests give their slot back
+    def test_slot_released_after_request(self):
+        response = self.app.test_client().get("/actors")
+        self.assertNotEqual(response.status_code, 503)
+        self.assertEqual(self.limiter.status()['active'], 0)
+
+    # Testcase: freed slots go to the highest priority waiter
+    def test_priority_order(self):
+        limiter = admission.ConcurrencyLimiter(1, 4, 5)
+        limiter.acquire(admission.READ)
+        threads, results = self.queue(
+            limiter, [admission.BULK, admission.WRITE, admission.READ])
+        limiter.release()
+        threads[2].join()
+        self.assertEqual(results, {admission.READ: 'admitted'})
+        limiter.release()
+        threads[1].join()
+        limiter.release()
+        threads[0].join()
+        self.assertEqual(set(results.values()), {'admitted'})
+
+    # Testcase: a full queue sheds bulk work for reads, waiters time out
+    def test_shedding_and_timeout(self):
+        limiter = admission.ConcurrencyLimiter(1, 1, 0.2)
+        limiter.acquire(admission.READ)
+        threads, results = self.queue(limiter, [admission.BULK])
+        more, results_read = self.queue(limiter, [admission.READ])
+        threads[0].join()
+        self.assertEqual(results, {admission.BULK: 'shed'})
+        with self.assertRaises(admission.AdmissionRejected):
+            limiter.acquire(admission.WRITE)
+        more[0].join()
+        self.assertEqual(results_read, {admission.READ: 'timeout'})
+        self.assertEqual(limiter.status()['queued'], 0)
+        self.assertEqual(limiter.status()['rejected'],
+                         {'shed': 1, 'queue_full': 1, 'timeout': 1})
+
+
+class CompressionTestCase(OfflineTestCase):
+    '''This class includes test cases for response compression'''
+
+    def get(self, path, encoding, **headers):
+        headers.update(self.headers)
+        headers['Accept-Encoding'] = encoding
+        return self.client().get(path, headers=headers)
+
+    # Testcase: list pages are gzipped when the client accepts gzip
+    def test_gzip_list_page(self):
+        plain = self.client().get("/actors?per_page=20",
+                                  headers=self.headers)
+        response = self.get("/actors?per_page=20", 'gzip')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+        self.assertLess(len(response.data), len(plain.data))
+
+    # Testcase: brotli is preferred when installed, q=0 disables an
+    # encoding
+    def test_negotiation(self):
+        response = self.get("/actors?per_page=20", 'gzip, br')
+        self.assertEqual(response.headers['Content-Encoding'],
+                         compression.available_encodings()[0])
+        response = self.get("/actors?per_page=20", 'gzip;q=0, br;q=0')
+        self.assertNotIn('Content-Encoding', response.headers)
+        if compression.brotli is not None:
+            response = self.get("/actors?per_page=20", 'br')
+            self.assertIn(b'"success":true',
+                          compression.brotli.decompress(response.data)
+                          .replace(b' ', b''))
+
+    # Testcase: small bodies such as /health are not compressed
+    def test_small_bodies_skipped(self):
+        response = self.get("/health", 'gzip')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(json.loads(response.data)['message'],
+                         'Welcome to Casting Agency')
+
+    # Testcase: streamed exports are compressed chunk by chunk
+    def test_streamed_export(self):
+        plain = self.client().get("/actors/export", headers=self.headers)
+        response = self.get("/actors/export", 'gzip')
+        self.assertTrue(response.is_streamed)
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+
+    # Testcase: compressed pages and their 304s carry the same ETag
+    def test_etag_same_on_compressed_and_not_modified(self):
+        response = self.get("/actors?per_page=20", 'gzip')
+        etag, weak = response.get_etag()
+        self.assertFalse(weak)
+        self.assertEqual(self.client().get("/actors?per_page=20",
+                                           headers=self.headers).get_etag(),
+                         (etag, False))
+        response = self.get("/actors?per_page=20", 'gzip',
+                            **{'If-None-Match': f'"{etag}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_etag(), (etag, False))
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+
+
+class SparseFieldsetTestCase(OfflineTestCase):
+    '''This class includes test cases for the fields parameter'''
+
+    # Returns the response and the SELECT statements run for it
+    def get_selecting(self, path):
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context,
+                    executemany):
+            if statement.startswith('SELECT'):
+                statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.get_engine(self.app)
+        event.listen(engine, 'before_cursor_execute', capture)
+        try:
+            response = self.client().get(path, headers=self.headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', capture)
+        return response, statements
+
+    # Testcase: list pages return and select only the requested fields
+    def test_list_fields(self):
+        response, statements = self.get_selecting(
+            "/actors?fields=name,id&per_page=3")
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([set(actor) for actor in data['actors']],
+                         [{'id', 'name'}] * 3)
+        page_select = [statement for statement in statements
+                       if 'LIMIT' in statement][0]
+        self.assertNotIn('actors.age', page_select)
+        self.assertNotIn('actors.identifier', page_select)
+
+    # Testcase: cursors work when the sort column is not a requested field
+    def test_fields_with_cursor(self):
+        response = self.client().get("/actors?fields=name&sort=-age"
+                                     "&per_page=5", headers=self.headers)
+        data = json.loads(response.data)
+        self.assertEqual(set(data['actors'][0]), {'name'})
+        response = self.client().get(
+            "/actors?fields=name&sort=-age&per_page=5&cursor="
+            + data['next_cursor'], headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)['actors']), 5)
+
+    # Testcase: movies keep their formatting and embedded casts
+    def test_movie_fields(self):
+        self.client().post("/movies/1/cast", json={"actor_id": 1},
+                           headers=self.headers)
+        response = self.client().get(
+            "/movies?fields=title,release_date&include=cast&per_page=1",
+            headers=self.headers)
+        movie = json.loads(response.data)['actors'][0]
+        self.assertEqual(set(movie), {'title', 'release_date', 'cast'})
+        self.assertEqual(movie['release_date'], '29/06/2015')
+        self.assertEqual(len(movie['cast']), 1)
+
+    # Testcase: detail endpoints return the requested fields, from the
+    # database and from the entity cache
+    def test_detail_fields(self):
+        response, statements = self.get_selecting("/actors/1?fields=gender")
+        data = json.loads(response.data)
+        self.assertEqual(list(data['actor_details']), ['gender'])
+        self.assertIn(data['actor_details']['gender'],
+                      ('Male', 'Female', 'Unknown'))
+        self.assertNotIn('actors.name', statements[-1])
+        full = json.loads(self.client().get(
+            "/actors/1", headers=self.headers).data)['actor_details']
+        response, statements = self.get_selecting("/actors/1?fields=name,age")
+        data = json.loads(response.data)
+        self.assertEqual(data['actor_details'],
+                         {'name': full['name'], 'age': full['age']})
+        # a cache hit only reads the row version
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('actors.name', statements[0])
+        response = self.client().get(
+            "/actors/by-identifier/" + full['identifier'] + "?fields=id",
+            headers=self.headers)
+        self.assertEqual(json.loads(response.data)['actor_details'],
+                         {'id': 1})
+
+    # Testcase: the ETag of a sparse fieldset does not revalidate the full
+    # entity, the same fieldset in any order does
+    def test_sparse_etag_differs(self):
+        sparse = self.client().get("/actors/1?fields=name",
+                                   headers=self.headers)
+        full = self.client().get("/actors/1", headers=self.headers)
+        self.assertNotEqual(sparse.get_etag(), full.get_etag())
+        headers = dict(self.headers)
+        headers['If-None-Match'] = f'"{sparse.get_etag()[0]}"'
+        response = self.client().get("/actors/1", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['actor_details'],
+                         json.loads(full.data)['actor_details'])
+        response = self.client().get("/actors/1?fields=name,name",
+                                     headers=headers)
+        self.assertEqual(response.status_code, 304)
+        identifier = json.loads(full.data)['actor_details']['identifier']
+        response = self.client().get(
+            "/actors/by-identifier/" + identifier + "?fields=name",
+            headers=self.headers)
+        self.assertEqual(response.get_etag(), sparse.get_etag())
+
+    # Testcase: unknown and empty fields are rejected
+    def test_unknown_fields_rejected(self):
+        for path in ("/actors?fields=name,salary", "/movies?fields=",
+                     "/movies/1?fields=name", "/actors/1?fields=version"):
+            response = self.client().get(path, headers=self.headers)
+            self.assertEqual(response.status_code, 400, path)
@@ -0,0 +1,115 @@
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+'''
+Response compression
+Compresses JSON, NDJSON, CSV and text bodies with brotli (when installed)
+or gzip, whichever the client prefers in Accept-Encoding. Bodies shorter
+than COMPRESS_MIN_SIZE bytes are sent as they are, the framing would
+outweigh the savings. Streamed responses (the exports) are compressed
+chunk by chunk as they are generated, without buffering the body.
+ETags stay strong on compressed bodies and on 304s alike; both carry
+Vary: Accept-Encoding, so caches keep the encodings apart and clients see
+one validator per resource.
+'''
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+# zlib level 1-9
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", 6))
+# brotli quality 0-11, the higher levels are too slow for dynamic bodies
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 4))
+COMPRESS_MIMETYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'text/csv',
+    'text/plain',
+    'text/html'
+}
+
+
+def available_encodings():
+    if brotli is not None:
+        return ['br', 'gzip']
+    return ['gzip']
+
+
+def _gzip_compressor(config):
+    # wbits 16 + MAX_WBITS writes the gzip header and trailer
+    compressor = zlib.compressobj(config['COMPRESS_LEVEL'], zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def _brotli_compressor(config):
+    compressor = brotli.Compressor(quality=config['COMPRESS_BROTLI_QUALITY'])
+    return compressor.process, compressor.finish
+
+
+COMPRESSORS = {
+    'gzip': _gzip_compressor,
+    'br': _brotli_compressor
+}
+
+
+def compress_stream(chunks, encoding, config):
+    compress, finish = COMPRESSORS[encoding](config)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        # closes stream_with_context generators, their teardown runs then
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_body(body, encoding, config):
+    compress, finish = COMPRESSORS[encoding](config)
+    return compress(body) + finish()
+
+
+def _compressible(response):
+    return 200 <= response.status_code < 300 \
+        and response.status_code != 204 \
+        and request.method != 'HEAD' \
+        and not response.direct_passthrough \
+        and 'Content-Encoding' not in response.headers \
+        and response.mimetype in COMPRESS_MIMETYPES
+
+
+# after_request hook
+def compress_response(response, config):
+    if not config['COMPRESS_RESPONSES']:
+        return response
+    if response.status_code == 304:
+        response.vary.add('Accept-Encoding')
+        return response
+    if not _compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding,
+                                            config)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress_body(body, encoding, config))
+    response.headers['Content-Encoding'] = encoding
+    return response
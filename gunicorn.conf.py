@@ -0,0 +1,42 @@
+import glob
+import os
+
+# The app is imported once in the master and shared by the forked workers,
+# app.create_app() does not touch the database so this is safe.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+WARMUP = os.getenv("WARMUP", "true").lower() == "true"
+# Workers write their metrics here, see metrics.py
+METRICS_DIR = os.getenv("prometheus_multiproc_dir")
+# `gevent` serves many in-flight requests per worker process
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+# Sockets, locks and threads must be cooperative before the app and its
+# module level locks are created, and before psycopg2 opens a connection.
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+    # without the patch every psycopg2 call blocks the whole worker, so a
+    # missing psycogreen must fail the start
+    if os.getenv("DATABASE_URL", "").startswith("postgres"):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+# Samples of a previous run would otherwise be added to the new ones. This
+# file is read before the app is loaded.
+if METRICS_DIR:
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.db')):
+        os.remove(path)
+
+
+def post_fork(server, worker):
+    if not WARMUP:
+        return
+    from app import app, warmup
+    warmup(app)
+
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
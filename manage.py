@@ -1,13 +1,62 @@
-from flask_script import Manager
-from flask_migrate import Migrate, MigrateCommand
+import sys
+
+from flask_script import Manager, Command, Option
+from flask_migrate import MigrateCommand
 
 from app import app
-from models.dbmodel import db
+from models.dbmodel import db_drop_and_create_all
+from models.importer import Importer, ImportAborted, IMPORT_BATCH_SIZE
+from models import stats
 
-migrate = Migrate(app, db)
 manager = Manager(app)
 
 manager.add_command('db', MigrateCommand)
 
+
+class CreateDbCommand(Command):
+    "Creates the missing tables of all models, existing tables are kept"
+
+    def run(self):
+        db_drop_and_create_all()
+
+
+manager.add_command('create_db', CreateDbCommand())
+
+
+class RecomputeStatsCommand(Command):
+    "Rebuilds the /stats counters from the actors and movies tables"
+
+    def run(self):
+        buckets = stats.recompute_stats()
+        print(f'{buckets} statistics buckets recomputed')
+
+
+manager.add_command('recompute_stats', RecomputeStatsCommand())
+
+
+class ImportCommand(Command):
+    "Streams actors or movies from a CSV or JSONL file into the database"
+
+    option_list = (
+        Option('kind', choices=('actors', 'movies')),
+        Option('path'),
+        Option('--format', dest='file_format', choices=('csv', 'jsonl'),
+               help='defaults to csv for *.csv files, jsonl otherwise'),
+        Option('--batch-size', dest='batch_size', type=int,
+               default=IMPORT_BATCH_SIZE),
+        Option('--resume', action='store_true',
+               help='continue after the last committed batch')
+    )
+
+    def run(self, kind, path, file_format, batch_size, resume):
+        try:
+            Importer(kind, path, file_format, batch_size).run(resume)
+        except ImportAborted as error:
+            sys.exit(str(error))
+
+
+manager.add_command('import', ImportCommand())
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,149 @@
+import os
+import time
+
+from flask import g, request
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               REGISTRY, CONTENT_TYPE_LATEST, generate_latest)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app_json import APIJSONEncoder
+
+'''
+Metrics
+Prometheus metrics for requests, admission control, JWT verification, the
+verified token cache, database statements and JSON serialization, served by
+GET /metrics.
+Under gunicorn every worker writes its samples to files in
+`prometheus_multiproc_dir` and /metrics merges the files of all workers, so
+the numbers do not depend on the worker that answers the scrape. The
+directory is emptied when gunicorn starts (see gunicorn.conf.py).
+'''
+
+MULTIPROC_DIR = os.getenv("prometheus_multiproc_dir")
+
+# seconds, from a cached token lookup up to a slow export
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUESTS = Counter(
+    'casting_http_requests_total',
+    'HTTP requests by route, method and status code',
+    ['method', 'route', 'status'])
+REQUEST_LATENCY = Histogram(
+    'casting_http_request_duration_seconds',
+    'Time from the start of the request to the response object',
+    ['method', 'route'], buckets=LATENCY_BUCKETS)
+ADMISSION_ACTIVE = Gauge(
+    'casting_admission_active_requests',
+    'Requests holding an admission slot',
+    multiprocess_mode='livesum')
+ADMISSION_QUEUE_DEPTH = Gauge(
+    'casting_admission_queue_depth',
+    'Requests waiting for an admission slot',
+    multiprocess_mode='livesum')
+ADMISSION_WAIT = Histogram(
+    'casting_admission_wait_seconds',
+    'Time admitted requests waited for a slot',
+    ['priority'], buckets=LATENCY_BUCKETS)
+ADMISSION_REJECTIONS = Counter(
+    'casting_admission_rejections_total',
+    'Requests answered with 503 by admission control',
+    ['priority', 'reason'])
+JWT_VERIFICATION = Histogram(
+    'casting_jwt_verification_seconds',
+    'Time spent authenticating a bearer token, cache hits included',
+    ['source'], buckets=LATENCY_BUCKETS)
+TOKEN_CACHE_LOOKUPS = Counter(
+    'casting_token_cache_lookups_total',
+    'Verified token cache lookups by result',
+    ['result'])
+DB_STATEMENT = Histogram(
+    'casting_db_statement_seconds',
+    'Execution time of single database statements',
+    buckets=LATENCY_BUCKETS)
+SERIALIZATION = Histogram(
+    'casting_json_serialization_seconds',
+    'Time spent encoding JSON response bodies',
+    buckets=LATENCY_BUCKETS)
+
+
+# Route template of the request, unmatched paths share one label value
+def route_label():
+    if request.url_rule is None:
+        return 'unmatched'
+    return request.url_rule.rule
+
+
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+def observe_request(response):
+    started = g.pop('request_started', None)
+    route = route_label()
+    REQUESTS.labels(request.method, route, response.status_code).inc()
+    if started is not None:
+        REQUEST_LATENCY.labels(request.method, route) \
+            .observe(time.perf_counter() - started)
+    return response
+
+
+def set_admission_state(active, queued):
+    ADMISSION_ACTIVE.set(active)
+    ADMISSION_QUEUE_DEPTH.set(queued)
+
+
+def observe_admission_wait(priority, seconds):
+    ADMISSION_WAIT.labels(priority).observe(seconds)
+
+
+def count_admission_rejection(priority, reason):
+    ADMISSION_REJECTIONS.labels(priority, reason).inc()
+
+
+def observe_jwt_verification(source, seconds):
+    JWT_VERIFICATION.labels(source).observe(seconds)
+
+
+def count_token_cache_lookup(hit):
+    TOKEN_CACHE_LOOKUPS.labels('hit' if hit else 'miss').inc()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('statement_started', []) \
+        .append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = conn.info['statement_started'].pop()
+    DB_STATEMENT.observe(time.perf_counter() - started)
+
+
+# Used as app.json_encoder, so jsonify bodies of all routes and error
+# handlers are timed
+class TimedJSONEncoder(APIJSONEncoder):
+    def encode(self, o):
+        with SERIALIZATION.time():
+            return super().encode(o)
+
+
+# Body and content type of the /metrics response
+def render_metrics():
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# gunicorn child_exit hook, drops the live gauges of the dead worker
+def mark_process_dead(pid):
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
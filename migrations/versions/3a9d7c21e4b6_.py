@@ -0,0 +1,29 @@
+"""keyset pagination indexes
+
+Revision ID: 3a9d7c21e4b6
+Revises: ce17fab19a2a
+Create Date: 2026-10-18 10:12:31.204815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a9d7c21e4b6'
+down_revision = 'ce17fab19a2a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_actors_name_id', 'actors', ['name', 'id'])
+    op.create_index('ix_movies_title_id', 'movies', ['title', 'id'])
+    op.create_index('ix_movies_release_date_id', 'movies',
+                    ['release_date', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_movies_release_date_id', table_name='movies')
+    op.drop_index('ix_movies_title_id', table_name='movies')
+    op.drop_index('ix_actors_name_id', table_name='actors')
@@ -0,0 +1,39 @@
+"""row versions and table versions for ETags
+
+Revision ID: 5e2b8f1d9c07
+Revises: 3a9d7c21e4b6
+Create Date: 2026-10-18 11:02:47.530112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2b8f1d9c07'
+down_revision = '3a9d7c21e4b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('actors', sa.Column('version', sa.Integer(),
+                                      server_default='1', nullable=False))
+    op.add_column('movies', sa.Column('version', sa.Integer(),
+                                      server_default='1', nullable=False))
+    table_versions = op.create_table(
+        'table_versions',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_versions, [
+        {'name': 'actors', 'version': 1},
+        {'name': 'movies', 'version': 1}
+    ])
+
+
+def downgrade():
+    op.drop_table('table_versions')
+    op.drop_column('movies', 'version')
+    op.drop_column('actors', 'version')
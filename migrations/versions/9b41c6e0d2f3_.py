@@ -0,0 +1,43 @@
+"""filter indexes for actors and movies
+
+Revision ID: 9b41c6e0d2f3
+Revises: 5e2b8f1d9c07
+Create Date: 2026-10-18 11:48:09.771640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b41c6e0d2f3'
+down_revision = '5e2b8f1d9c07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_actors_age_id', 'actors', ['age', 'id'])
+    op.create_index('ix_actors_gender_age', 'actors', ['gender', 'age'])
+    op.create_index('ix_movies_production_house_release_date', 'movies',
+                    ['production_house', 'release_date'])
+    op.create_index('ix_movies_ott_partner_release_date', 'movies',
+                    ['ott_partner', 'release_date'])
+    # name and title prefix filters use LIKE 'prefix%', which PostgreSQL
+    # only answers from an index built with text_pattern_ops
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index('ix_actors_name_pattern', 'actors', ['name'],
+                        postgresql_ops={'name': 'text_pattern_ops'})
+        op.create_index('ix_movies_title_pattern', 'movies', ['title'],
+                        postgresql_ops={'title': 'text_pattern_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_movies_title_pattern', table_name='movies')
+        op.drop_index('ix_actors_name_pattern', table_name='actors')
+    op.drop_index('ix_movies_ott_partner_release_date', table_name='movies')
+    op.drop_index('ix_movies_production_house_release_date',
+                  table_name='movies')
+    op.drop_index('ix_actors_gender_age', table_name='actors')
+    op.drop_index('ix_actors_age_id', table_name='actors')
@@ -0,0 +1,38 @@
+"""identifier uniqueness as uq_<table>_identifier indexes on PostgreSQL
+
+Revision ID: a3f6d1c8e7b2
+Revises: d5a7c9e2f4b6
+Create Date: 2026-10-19 09:12:37.804155
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f6d1c8e7b2'
+down_revision = 'd5a7c9e2f4b6'
+branch_labels = None
+depends_on = None
+
+TABLES = ('actors', 'movies')
+
+
+# SQLite got the unique indexes in revision e4a9d3f6b2c8, PostgreSQL kept
+# the unique constraints of the original columns
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in TABLES:
+        op.execute(f"ALTER TABLE {table} "
+                   f"DROP CONSTRAINT IF EXISTS {table}_identifier_key")
+        op.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table}_identifier "
+                   f"ON {table} (identifier)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in TABLES:
+        op.drop_index(f'uq_{table}_identifier', table_name=table)
+        op.create_unique_constraint(f'{table}_identifier_key', table,
+                                    ['identifier'])
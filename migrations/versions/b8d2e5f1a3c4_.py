@@ -0,0 +1,41 @@
+"""castings: actors cast in movies
+
+Revision ID: b8d2e5f1a3c4
+Revises: e4a9d3f6b2c8
+Create Date: 2026-10-18 21:05:41.203918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d2e5f1a3c4'
+down_revision = 'e4a9d3f6b2c8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'castings',
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('actor_id', sa.Integer(), nullable=False),
+        sa.Column('role', sa.String(length=100), nullable=True),
+        sa.Column('billing_order', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['actor_id'], ['actors.id'],
+                                ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['movie_id'], ['movies.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('movie_id', 'actor_id')
+    )
+    op.create_index('ix_castings_actor_id_movie_id', 'castings',
+                    ['actor_id', 'movie_id'], unique=False)
+    op.execute("INSERT INTO table_versions (name, version) "
+               "VALUES ('castings', 1)")
+
+
+def downgrade():
+    op.execute("DELETE FROM table_versions WHERE name = 'castings'")
+    op.drop_index('ix_castings_actor_id_movie_id', table_name='castings')
+    op.drop_table('castings')
@@ -0,0 +1,61 @@
+"""full-text search index for actor names and movie titles
+
+Revision ID: c7f3a2b85e19
+Revises: 9b41c6e0d2f3
+Create Date: 2026-10-18 12:35:52.118094
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7f3a2b85e19'
+down_revision = '9b41c6e0d2f3'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = {
+    'actors': 'name',
+    'movies': 'title'
+}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    for table, column in SEARCH_COLUMNS.items():
+        if dialect == 'postgresql':
+            op.execute(f"ALTER TABLE {table} ADD COLUMN search_vector "
+                       f"tsvector GENERATED ALWAYS AS "
+                       f"(to_tsvector('simple', coalesce({column}, ''))) "
+                       f"STORED")
+            op.execute(f"CREATE INDEX ix_{table}_search_vector "
+                       f"ON {table} USING GIN (search_vector)")
+        elif dialect == 'sqlite':
+            op.execute(f"CREATE VIRTUAL TABLE {table}_search "
+                       f"USING fts5({column})")
+            op.execute(f"INSERT INTO {table}_search(rowid, {column}) "
+                       f"SELECT id, {column} FROM {table}")
+            op.execute(f"CREATE TRIGGER {table}_search_insert "
+                       f"AFTER INSERT ON {table} BEGIN "
+                       f"INSERT INTO {table}_search(rowid, {column}) "
+                       f"VALUES (new.id, new.{column}); END")
+            op.execute(f"CREATE TRIGGER {table}_search_update "
+                       f"AFTER UPDATE OF {column} ON {table} BEGIN "
+                       f"UPDATE {table}_search SET {column} = new.{column} "
+                       f"WHERE rowid = old.id; END")
+            op.execute(f"CREATE TRIGGER {table}_search_delete "
+                       f"AFTER DELETE ON {table} BEGIN "
+                       f"DELETE FROM {table}_search WHERE rowid = old.id; END")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table in SEARCH_COLUMNS:
+        if dialect == 'postgresql':
+            op.execute(f"DROP INDEX ix_{table}_search_vector")
+            op.execute(f"ALTER TABLE {table} DROP COLUMN search_vector")
+        elif dialect == 'sqlite':
+            for trigger in ('insert', 'update', 'delete'):
+                op.execute(f"DROP TRIGGER {table}_search_{trigger}")
+            op.execute(f"DROP TABLE {table}_search")
@@ -0,0 +1,65 @@
+"""catalogue_stats counters for /stats
+
+Revision ID: d5a7c9e2f4b6
+Revises: b8d2e5f1a3c4
+Create Date: 2026-10-18 21:48:09.517320
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a7c9e2f4b6'
+down_revision = 'b8d2e5f1a3c4'
+branch_labels = None
+depends_on = None
+
+# as in models.stats at the time of this revision
+AGE_BUCKETS = ((0, 17), (18, 24), (25, 34), (35, 44), (45, 54), (55, 64))
+NONE_BUCKET = '(none)'
+DIMENSIONS = (
+    ('actor_gender', 'actors', 'gender'),
+    ('actor_age', 'actors', 'age'),
+    ('movie_production_house', 'movies', 'production_house'),
+    ('movie_ott_partner', 'movies', 'ott_partner')
+)
+
+
+def _bucket(dimension, value):
+    if dimension == 'actor_age':
+        for low, high in AGE_BUCKETS:
+            if value <= high:
+                return f'{low}-{high}'
+        return f'{AGE_BUCKETS[-1][1] + 1}+'
+    if value is None or value == '':
+        return NONE_BUCKET
+    return str(value)
+
+
+def upgrade():
+    catalogue_stats = op.create_table(
+        'catalogue_stats',
+        sa.Column('dimension', sa.String(length=30), nullable=False),
+        sa.Column('bucket', sa.String(length=100), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('dimension', 'bucket')
+    )
+
+    bind = op.get_bind()
+    counts = {}
+    for dimension, table, column in DIMENSIONS:
+        rows = bind.execute(sa.text(
+            f"SELECT {column}, count(*) FROM {table} GROUP BY {column}"))
+        for value, count in rows:
+            key = (dimension, _bucket(dimension, value))
+            counts[key] = counts.get(key, 0) + count
+    if counts:
+        op.bulk_insert(catalogue_stats, [
+            {'dimension': dimension, 'bucket': bucket, 'count': count}
+            for (dimension, bucket), count in sorted(counts.items())
+        ])
+
+
+def downgrade():
+    op.drop_table('catalogue_stats')
@@ -0,0 +1,103 @@
+"""store identifiers as native UUID / 16 bytes
+
+Revision ID: e4a9d3f6b2c8
+Revises: c7f3a2b85e19
+Create Date: 2026-10-18 13:20:14.602387
+
+"""
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a9d3f6b2c8'
+down_revision = 'c7f3a2b85e19'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = {
+    'actors': 'name',
+    'movies': 'title'
+}
+TABLES = tuple(SEARCH_COLUMNS)
+
+
+def _convert(table, source, target, convert):
+    bind = op.get_bind()
+    rows = bind.execute(sa.text(
+        f"SELECT id, {source} FROM {table} WHERE {source} IS NOT NULL"))
+    for entity_id, value in rows.fetchall():
+        bind.execute(sa.text(
+            f"UPDATE {table} SET {target} = :value WHERE id = :id"),
+            {'value': convert(value), 'id': entity_id})
+
+
+# batch mode re-creates the table on SQLite, which drops the triggers
+# maintaining the full-text search index (revision c7f3a2b85e19)
+def _create_search_triggers(table):
+    column = SEARCH_COLUMNS[table]
+    op.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_insert "
+               f"AFTER INSERT ON {table} BEGIN "
+               f"INSERT INTO {table}_search(rowid, {column}) "
+               f"VALUES (new.id, new.{column}); END")
+    op.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_update "
+               f"AFTER UPDATE OF {column} ON {table} BEGIN "
+               f"UPDATE {table}_search SET {column} = new.{column} "
+               f"WHERE rowid = old.id; END")
+    op.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_delete "
+               f"AFTER DELETE ON {table} BEGIN "
+               f"DELETE FROM {table}_search WHERE rowid = old.id; END")
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for table in TABLES:
+            op.alter_column(table, 'identifier',
+                            existing_type=sa.String(length=36),
+                            type_=postgresql.UUID(),
+                            postgresql_using='identifier::uuid')
+        return
+
+    for table in TABLES:
+        # left behind by a previous downgrade
+        op.execute(f"DROP INDEX IF EXISTS uq_{table}_identifier")
+        op.add_column(table, sa.Column('identifier_bytes', sa.BINARY(16),
+                                       nullable=True))
+        _convert(table, 'identifier', 'identifier_bytes',
+                 lambda value: uuid.UUID(value).bytes)
+        reflect_args = [sa.Column('identifier_bytes', sa.BINARY(16))]
+        with op.batch_alter_table(table,
+                                  reflect_args=reflect_args) as batch_op:
+            batch_op.drop_column('identifier')
+            batch_op.alter_column('identifier_bytes',
+                                  new_column_name='identifier')
+        op.create_index(f'uq_{table}_identifier', table, ['identifier'],
+                        unique=True)
+        _create_search_triggers(table)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for table in TABLES:
+            op.alter_column(table, 'identifier',
+                            existing_type=postgresql.UUID(),
+                            type_=sa.String(length=36),
+                            postgresql_using='identifier::text')
+        return
+
+    for table in TABLES:
+        op.add_column(table, sa.Column('identifier_text', sa.String(36),
+                                       nullable=True))
+        _convert(table, 'identifier', 'identifier_text',
+                 lambda value: str(uuid.UUID(bytes=bytes(value))))
+        op.drop_index(f'uq_{table}_identifier', table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('identifier')
+            batch_op.alter_column('identifier_text',
+                                  new_column_name='identifier')
+        op.create_index(f'uq_{table}_identifier', table, ['identifier'],
+                        unique=True)
+        _create_search_triggers(table)
@@ -0,0 +1,141 @@
+import json
+import os
+
+import app_utils
+from models.dbmodel import db, touch_table, table_changed
+from models.stats import rows_added
+
+'''
+Bulk inserts
+Items are validated into plain column dicts first, then written with one
+executemany per chunk inside a single transaction. Identifiers are generated
+up front so the ids of a chunk can be read back with one query on any
+database.
+'''
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 500))
+MAX_BULK_ITEMS = int(os.getenv("MAX_BULK_ITEMS", 10000))
+
+
+class BulkItemError(ValueError):
+    pass
+
+
+# Accepts a JSON array, an object holding the array under `key`, or NDJSON
+# when the mimetype is application/x-ndjson. Returns a list of items where
+# unparsable NDJSON lines are BulkItemError instances.
+def parse_bulk_body(request, key):
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(BulkItemError('Invalid JSON line'))
+        return items
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get(key)
+    if not isinstance(data, list):
+        raise ValueError('Request body must be a list of items')
+    return data
+
+
+def _required_string(data, field, max_length=None):
+    value = data.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise BulkItemError(f'{field} is required')
+    if max_length is not None and len(value) > max_length:
+        raise BulkItemError(f'{field} is longer than {max_length}')
+    return value
+
+
+def _optional_string(data, field, max_length):
+    value = data.get(field)
+    if value is None:
+        return None
+    if not isinstance(value, str) or len(value) > max_length:
+        raise BulkItemError(f'{field} must be a string of at most '
+                            f'{max_length} characters')
+    return value
+
+
+def actor_row(data):
+    if not isinstance(data, dict):
+        raise BulkItemError('Item must be an object')
+    age = data.get('age')
+    if not isinstance(age, int) or isinstance(age, bool) or age < 0:
+        raise BulkItemError('age must be a positive integer')
+    return {
+        'name': _required_string(data, 'name'),
+        'age': age,
+        'gender': app_utils.get_gender_code(_required_string(data, 'gender')),
+        'identifier': app_utils.generate_guid()
+    }
+
+
+def movie_row(data):
+    if not isinstance(data, dict):
+        raise BulkItemError('Item must be an object')
+    try:
+        release_date = app_utils.get_datetime(
+            _required_string(data, 'release_date'))
+    except BulkItemError:
+        raise
+    except ValueError:
+        raise BulkItemError('release_date must be in dd/mm/yyyy format')
+    return {
+        'title': _required_string(data, 'title'),
+        'release_date': release_date,
+        'production_house': _optional_string(data, 'production_house', 50),
+        'ott_partner': _optional_string(data, 'ott_partner', 20),
+        'identifier': app_utils.generate_guid()
+    }
+
+
+# Validates every item, inserts the valid ones and returns one result per
+# item in request order: either its id and identifier or its error.
+def bulk_create(model, items, row_builder, chunk_size=BULK_CHUNK_SIZE):
+    results = []
+    rows = []
+    for index, item in enumerate(items):
+        try:
+            if isinstance(item, BulkItemError):
+                raise item
+            row = row_builder(item)
+        except BulkItemError as error:
+            results.append({'index': index, 'error': str(error)})
+            continue
+        rows.append(row)
+        results.append({'index': index, 'identifier': row['identifier']})
+
+    ids = insert_rows(model, rows, chunk_size)
+    for result in results:
+        if 'identifier' in result:
+            result['id'] = ids[result['identifier']]
+    return results
+
+
+def insert_rows(model, rows, chunk_size=BULK_CHUNK_SIZE):
+    table = model.__table__
+    ids = {}
+    try:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            db.session.execute(table.insert(), chunk)
+            identifiers = [row['identifier'] for row in chunk]
+            inserted = db.session.query(model.id, model.identifier) \
+                .filter(model.identifier.in_(identifiers))
+            ids.update((identifier, id) for id, identifier in inserted)
+        if rows:
+            rows_added(model, rows)
+            touch_table(table.name)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if rows:
+        table_changed(table.name)
+    return ids
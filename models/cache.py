@@ -0,0 +1,137 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+'''
+Response cache
+Serialized JSON bodies of list pages, keyed by table, table version and the
+normalized query string. The table version lives in the database, so a page
+cached by one worker is never served after another worker changed the
+table; local writes additionally drop the entries of their table.
+
+Entity cache
+Formatted actors and movies by id with their row version, in front of the
+detail lookups. Local writes drop the entry right away, changes made by
+other workers become visible after ENTITY_CACHE_TTL seconds.
+'''
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 1048576))
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", 1024))
+ENTITY_CACHE_TTL = int(os.getenv("ENTITY_CACHE_TTL", 30))
+
+
+class ResponseCache:
+    def __init__(self, maxsize=256, max_bytes=1048576):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        if self.maxsize <= 0 or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # keys are (table, version, ...) tuples
+    def invalidate(self, table=None):
+        with self._lock:
+            if table is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == table]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+class EntityCache:
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, table, entity_id):
+        key = (table, entity_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, table, entity_id, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return value
+        key = (table, entity_id)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, table=None, entity_id=None):
+        with self._lock:
+            if table is None:
+                self._entries.clear()
+            elif entity_id is not None:
+                self._entries.pop((table, entity_id), None)
+            else:
+                for key in [key for key in self._entries
+                            if key[0] == table]:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+response_cache = ResponseCache(maxsize=RESPONSE_CACHE_SIZE,
+                               max_bytes=RESPONSE_CACHE_MAX_BYTES)
+entity_cache = EntityCache(maxsize=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL)
+
+
+def make_etag(*parts):
+    key = '|'.join(str(part) for part in parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
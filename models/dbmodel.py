@@ -1,8 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, String, Integer, DateTime, CHAR
+from sqlalchemy import (Column, String, Integer, DateTime, CHAR, Index, BINARY,
+                        ForeignKey, text)
+from sqlalchemy.orm import relationship
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import TypeDecorator
 import os
+import uuid
 
 import app_utils
+from models.cache import response_cache, entity_cache
+from models.pagination import count_cache
+from models.pool import engine_options
 
 database_path = os.getenv("DATABASE_URL", "<db-url-goes-here>")
 
@@ -12,6 +20,7 @@ db = SQLAlchemy()
 def setup_db(app, database_path=database_path):
     app.config['SQLALCHEMY_DATABASE_URI'] = database_path
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(database_path)
     db.app = app
     db.init_app(app)
 
@@ -19,6 +28,100 @@ def setup_db(app, database_path=database_path):
 def db_drop_and_create_all():
     # db.drop_all()
     db.create_all()
+    db.session.execute(SEED_TABLE_VERSION,
+                       [{'name': name} for name in VERSIONED_TABLES])
+    db.session.commit()
+
+
+'''
+Type: GUID
+UUID stored natively on PostgreSQL and as 16 raw bytes elsewhere, read and
+written as the canonical string form.
+'''
+
+
+class GUID(TypeDecorator):
+    impl = BINARY(16)
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID())
+        return dialect.type_descriptor(BINARY(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(str(value))
+        if dialect.name == 'postgresql':
+            return str(value)
+        return value.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name == 'postgresql':
+            return str(value)
+        return str(uuid.UUID(bytes=bytes(value)))
+
+
+'''
+Model: TableVersion
+Version of each table, bumped in the transaction of every insert, update
+and delete. List ETags and cached list pages are derived from it.
+'''
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+# seeded by the migrations and db_drop_and_create_all
+VERSIONED_TABLES = ('actors', 'movies', 'castings')
+SEED_TABLE_VERSION = text(
+    'INSERT INTO table_versions (name, version) VALUES (:name, 1) '
+    'ON CONFLICT (name) DO NOTHING')
+# Upsert, so the first writes of a table without a row do not race on the
+# primary key (PostgreSQL, SQLite 3.24+)
+TOUCH_TABLE = text(
+    'INSERT INTO table_versions (name, version) VALUES (:name, 1) '
+    'ON CONFLICT (name) '
+    'DO UPDATE SET version = table_versions.version + 1')
+
+
+def get_table_version(name):
+    version = db.session.query(TableVersion.version) \
+        .filter(TableVersion.name == name).scalar()
+    return version or 0
+
+
+'''
+Model: CatalogueStat
+Number of actors / movies per bucket of a dimension (actor gender, actor age
+bucket, production house, OTT partner), maintained by models.stats.
+'''
+
+
+class CatalogueStat(db.Model):
+    __tablename__ = 'catalogue_stats'
+    dimension = Column(String(30), primary_key=True)
+    bucket = Column(String(100), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+# Call before committing a change to the table
+def touch_table(name):
+    db.session.execute(TOUCH_TABLE, {'name': name})
+
+
+# Call after committing a change to the table
+def table_changed(name, entity_id=None):
+    count_cache.invalidate(name)
+    response_cache.invalidate(name)
+    if entity_id is not None:
+        entity_cache.invalidate(name, entity_id)
 
 
 '''
@@ -32,18 +135,46 @@ class Actor(db.Model):
     name = Column(String, nullable=False)
     age = Column(Integer, nullable=False)
     gender = Column(CHAR(1), nullable=False)
-    identifier = Column(String(36), unique=True, default=None)
+    identifier = Column(GUID, default=None)
+    # row version, incremented by SQLAlchemy on every update
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+
+    # unique identifier index (as created by the migrations), keyset
+    # pagination and filter indexes, see models.pagination and the list
+    # filters in app.py
+    __table_args__ = (
+        Index('uq_actors_identifier', 'identifier', unique=True),
+        Index('ix_actors_name_id', 'name', 'id'),
+        Index('ix_actors_age_id', 'age', 'id'),
+        Index('ix_actors_gender_age', 'gender', 'age'),
+    )
+    __mapper_args__ = {'version_id_col': version}
+
+    # movies the actor is cast in, removed together with the actor
+    castings = relationship('Casting', back_populates='actor',
+                            cascade='all, delete-orphan')
+
+    # keys returned by format()
+    FIELDS = ('id', 'name', 'age', 'gender', 'identifier')
 
     def insert(self):
         db.session.add(self)
+        touch_table(self.__tablename__)
         db.session.commit()
+        table_changed(self.__tablename__)
 
     def delete(self):
+        entity_id = self.id
         db.session.delete(self)
+        touch_table(self.__tablename__)
         db.session.commit()
+        table_changed(self.__tablename__, entity_id)
 
     def update(self):
+        entity_id = self.id
+        touch_table(self.__tablename__)
         db.session.commit()
+        table_changed(self.__tablename__, entity_id)
 
     def __repr__(self):
         return f"Name: {self.name}, age: {self.age}"
@@ -73,18 +204,51 @@ class Movie(db.Model):
     release_date = Column(DateTime, nullable=False)
     production_house = Column(String(50))
     ott_partner = Column(String(20))
-    identifier = Column(String(36), unique=True, default=None)
+    identifier = Column(GUID, default=None)
+    # row version, incremented by SQLAlchemy on every update
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+
+    # unique identifier index (as created by the migrations), keyset
+    # pagination and filter indexes, see models.pagination and the list
+    # filters in app.py
+    __table_args__ = (
+        Index('uq_movies_identifier', 'identifier', unique=True),
+        Index('ix_movies_title_id', 'title', 'id'),
+        Index('ix_movies_release_date_id', 'release_date', 'id'),
+        Index('ix_movies_production_house_release_date',
+              'production_house', 'release_date'),
+        Index('ix_movies_ott_partner_release_date',
+              'ott_partner', 'release_date'),
+    )
+    __mapper_args__ = {'version_id_col': version}
+
+    # cast in billing order, removed together with the movie
+    cast = relationship('Casting', back_populates='movie',
+                        cascade='all, delete-orphan',
+                        order_by='[Casting.billing_order, Casting.actor_id]')
+
+    # keys returned by format()
+    FIELDS = ('id', 'title', 'release_date', 'production_house',
+              'ott_partner', 'identifier')
 
     def insert(self):
         db.session.add(self)
+        touch_table(self.__tablename__)
         db.session.commit()
+        table_changed(self.__tablename__)
 
     def delete(self):
+        entity_id = self.id
         db.session.delete(self)
+        touch_table(self.__tablename__)
         db.session.commit()
+        table_changed(self.__tablename__, entity_id)
 
     def update(self):
+        entity_id = self.id
+        touch_table(self.__tablename__)
         db.session.commit()
+        table_changed(self.__tablename__, entity_id)
 
     def __repr__(self):
         f"Title: {self.title}, release_date: {self.release_date}"
@@ -93,9 +257,56 @@ class Movie(db.Model):
         return {
             "id": self.id,
             "title": self.title,
-            "release_date": app_utils.get_datetime_as_str(self.release_date),
+            "release_date": self.release_date,
             "production_house": self.production_house,
             "ott_partner": self.ott_partner,
             "identifier": self.identifier
 
         }
+
+
+'''
+Model: Casting
+Actor cast in a movie, with the role played and the position in the
+billing (1 is top billed). Cast lists and filmographies load the related
+rows with selectinload/joinedload, see the cast endpoints in app.py.
+'''
+
+
+class Casting(db.Model):
+    __tablename__ = 'castings'
+    movie_id = Column(Integer, ForeignKey('movies.id', ondelete='CASCADE'),
+                      primary_key=True)
+    actor_id = Column(Integer, ForeignKey('actors.id', ondelete='CASCADE'),
+                      primary_key=True)
+    role = Column(String(100))
+    billing_order = Column(Integer, nullable=False)
+
+    movie = relationship('Movie', back_populates='cast')
+    actor = relationship('Actor', back_populates='castings')
+
+    # filmography lookups, the primary key covers the cast lookups
+    __table_args__ = (
+        Index('ix_castings_actor_id_movie_id', 'actor_id', 'movie_id'),
+    )
+
+    def insert(self):
+        db.session.add(self)
+        touch_table(self.__tablename__)
+        db.session.commit()
+        table_changed(self.__tablename__)
+
+    def delete(self):
+        db.session.delete(self)
+        touch_table(self.__tablename__)
+        db.session.commit()
+        table_changed(self.__tablename__)
+
+    def __repr__(self):
+        return f"Movie: {self.movie_id}, actor: {self.actor_id}"
+
+    def format(self):
+        return {
+            'role': self.role,
+            'billing_order': self.billing_order
+        }
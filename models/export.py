@@ -0,0 +1,53 @@
+import csv
+import io
+import os
+
+from app_json import dumps, text_value
+
+'''
+Streaming exports
+Rows are read through a server-side cursor (models.rows.iter_rows) and
+written out in batches as NDJSON or CSV, so memory use does not depend on
+table size.
+'''
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def export_ndjson(rows, formatter, batch_size=EXPORT_BATCH_SIZE):
+    lines = []
+    for row in rows:
+        lines.append(dumps(formatter(row)))
+        if len(lines) >= batch_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def export_csv(rows, formatter, fieldnames, batch_size=EXPORT_BATCH_SIZE):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writeheader()
+    written = 0
+    for row in rows:
+        values = formatter(row)
+        writer.writerow({field: text_value(values[field])
+                         for field in fieldnames})
+        written += 1
+        if written % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_rows(rows, formatter, fieldnames, export_format):
+    if export_format == 'csv':
+        return export_csv(rows, formatter, fieldnames)
+    return export_ndjson(rows, formatter)
@@ -0,0 +1,247 @@
+import csv
+import io
+import json
+import os
+import time
+import uuid
+
+from models.bulk import BulkItemError, actor_row, movie_row
+from models.dbmodel import db, Actor, Movie, touch_table, table_changed
+from models.stats import rows_added
+
+'''
+Bulk import
+Streams actors or movies from a CSV (header row) or JSONL file into the
+database in batches: COPY on PostgreSQL, one executemany elsewhere, one
+transaction per batch. Items use the fields of the POST endpoints, an
+`identifier` column (as written by the exports) is kept, other columns
+are ignored.
+
+Progress is saved next to the input in <file>.import-state. Before a batch
+is committed the state records the batch as pending together with the
+identifier of its last row, so --resume can tell whether an interrupted
+batch was committed and continues right after the last committed line.
+'''
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 5000))
+IMPORT_REPORT_INTERVAL = float(os.getenv("IMPORT_REPORT_INTERVAL", 5))
+
+IMPORT_KINDS = {
+    'actors': (Actor, actor_row),
+    'movies': (Movie, movie_row)
+}
+
+
+class ImportAborted(Exception):
+    pass
+
+
+def detect_format(path, file_format=None):
+    if file_format:
+        return file_format
+    if path.endswith('.csv'):
+        return 'csv'
+    return 'jsonl'
+
+
+# Yields (line number, item) pairs, unparsable lines as BulkItemError
+def read_items(stream, file_format):
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for item in reader:
+            yield reader.line_num, item
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, BulkItemError('Invalid JSON line')
+
+
+# CSV values are strings, the row builders expect JSON types
+def _coerce(item):
+    if isinstance(item, dict) and isinstance(item.get('age'), str) \
+            and item['age'].strip().isdigit():
+        item['age'] = int(item['age'])
+    return item
+
+
+def build_row(row_builder, item):
+    if isinstance(item, BulkItemError):
+        raise item
+    row = row_builder(_coerce(item))
+    identifier = item.get('identifier')
+    if identifier:
+        try:
+            row['identifier'] = str(uuid.UUID(identifier))
+        except (TypeError, ValueError, AttributeError):
+            raise BulkItemError('identifier must be a UUID')
+    return row
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+# COPY ... FROM STDIN in text format on the session's connection
+def _copy_rows(table, rows):
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(row[column])
+                               for column in columns))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY {table.name} ({", ".join(columns)}) '
+                           f'FROM STDIN', buffer)
+    finally:
+        cursor.close()
+
+
+def write_batch(model, rows):
+    table = model.__table__
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            _copy_rows(table, rows)
+        else:
+            db.session.execute(table.insert(), rows)
+        rows_added(model, rows)
+        touch_table(table.name)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    table_changed(table.name)
+
+
+class ImportState:
+    def __init__(self, path):
+        self.path = path + '.import-state'
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as state_file:
+            return json.load(state_file)
+
+    def save(self, **state):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# Line after which the import continues: the pending batch counts as done
+# when its last row made it into the database
+def resume_position(model, state):
+    if state is None:
+        return 0, 0
+    if state.get('pending'):
+        committed = db.session.query(model.id) \
+            .filter(model.identifier == state['pending']['identifier']) \
+            .first() is not None
+        if committed:
+            return (state['pending']['line'],
+                    state['imported'] + state['pending']['rows'])
+    return state['line'], state['imported']
+
+
+class Importer:
+    def __init__(self, kind, path, file_format=None,
+                 batch_size=IMPORT_BATCH_SIZE, report=print):
+        if kind not in IMPORT_KINDS:
+            raise ImportAborted(f'Unknown kind {kind}, use actors or movies')
+        self.kind = kind
+        self.model, self.row_builder = IMPORT_KINDS[kind]
+        self.path = path
+        self.file_format = detect_format(path, file_format)
+        self.batch_size = batch_size
+        self.report = report
+        self.state = ImportState(path)
+        self.errors = []
+        self.rows = []
+        self.line = 0
+        self.imported = 0
+        self.new_rows = 0
+
+    def run(self, resume=False):
+        saved = self.state.load()
+        if saved is not None and not resume:
+            raise ImportAborted(f'{self.state.path} exists, pass --resume '
+                                f'to continue the previous import')
+        if saved is not None and saved.get('kind') != self.kind:
+            raise ImportAborted(f'{self.state.path} belongs to an import of '
+                                f'{saved.get("kind")}')
+        self.line, self.imported = resume_position(self.model, saved)
+        committed_line = self.line
+        self.started = self.last_report = time.monotonic()
+
+        with open(self.path, newline='', encoding='utf-8') as stream:
+            for line, item in read_items(stream, self.file_format):
+                if line <= committed_line:
+                    continue
+                try:
+                    self.rows.append(build_row(self.row_builder, item))
+                except BulkItemError as error:
+                    self.errors.append({'line': line, 'error': str(error)})
+                    continue
+                if len(self.rows) >= self.batch_size:
+                    self.flush(line)
+            if self.rows:
+                self.flush(line)
+
+        self.state.remove()
+        return self.summary()
+
+    def flush(self, line):
+        self.state.save(kind=self.kind, line=self.line,
+                        imported=self.imported, pending={
+                            'line': line,
+                            'rows': len(self.rows),
+                            'identifier': self.rows[-1]['identifier']
+                        })
+        write_batch(self.model, self.rows)
+        self.line = line
+        self.imported += len(self.rows)
+        self.new_rows += len(self.rows)
+        self.rows = []
+        self.state.save(kind=self.kind, line=self.line,
+                        imported=self.imported, pending=None)
+        now = time.monotonic()
+        if now - self.last_report >= IMPORT_REPORT_INTERVAL:
+            self.last_report = now
+            self.report(f'{self.imported} rows imported, '
+                        f'{self.new_rows / (now - self.started):.0f} '
+                        f'rows/sec')
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        summary = {
+            'kind': self.kind,
+            'imported': self.imported,
+            'new_rows': self.new_rows,
+            'errors': self.errors,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(self.new_rows / elapsed, 1)
+            if elapsed else 0.0
+        }
+        self.report(f'{self.imported} rows imported ({self.new_rows} in this '
+                    f'run) in {elapsed:.1f}s, '
+                    f'{summary["rows_per_second"]} rows/sec, '
+                    f'{len(self.errors)} invalid rows')
+        for error in self.errors[:20]:
+            self.report(f'  line {error["line"]}: {error["error"]}')
+        return summary
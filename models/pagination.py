@@ -0,0 +1,143 @@
+import base64
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime
+
+from sqlalchemy import func, tuple_
+
+'''
+Pagination helpers
+Pages are fetched over a stable ORDER BY, either with LIMIT/OFFSET or, when a
+cursor is given, as a keyset range scan starting after the last row of the
+previous page. One extra row is requested to know whether a next page
+exists, and the total comes from a COUNT query that can be cached per table.
+'''
+
+Page = namedtuple('Page', ['items', 'page', 'per_page', 'total', 'next_page',
+                           'next_cursor'])
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class SortKey:
+    '''Ordered columns of a list endpoint, the last one must be unique'''
+
+    def __init__(self, name, columns, descending=False):
+        self.name = name
+        self.columns = columns
+        self.descending = descending
+
+    def order_by(self):
+        if self.descending:
+            return [column.desc() for column in self.columns]
+        return [column.asc() for column in self.columns]
+
+    def after(self, values):
+        if len(self.columns) == 1:
+            left, right = self.columns[0], values[0]
+        else:
+            left, right = tuple_(*self.columns), tuple_(*values)
+        return left < right if self.descending else left > right
+
+    def encode_cursor(self, row):
+        values = [_to_json(getattr(row, column.key))
+                  for column in self.columns]
+        document = json.dumps([self.name, self.descending, values],
+                              separators=(',', ':'))
+        return base64.urlsafe_b64encode(document.encode('utf-8')) \
+            .decode('ascii').rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            name, descending, values = json.loads(
+                base64.urlsafe_b64decode(padded.encode('ascii')))
+            if name != self.name or descending != self.descending \
+                    or len(values) != len(self.columns):
+                raise InvalidCursor('Cursor does not match the sort order')
+            return [_from_json(column, value)
+                    for column, value in zip(self.columns, values)]
+        except InvalidCursor:
+            raise
+        except Exception:
+            raise InvalidCursor('Malformed cursor')
+
+
+def _to_json(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _from_json(column, value):
+    if value is not None and column.type.python_type in (date, datetime):
+        return datetime.fromisoformat(value)
+    return value
+
+
+class CountCache:
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        if self.ttl <= 0:
+            return compute()
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(key)
+        if cached is not None and now - cached[1] < self.ttl:
+            return cached[0]
+        count = compute()
+        with self._lock:
+            self._counts[key] = (count, now)
+        return count
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._counts.clear()
+            else:
+                self._counts.pop(key, None)
+
+
+# Seconds a table row count is reused, 0 counts on every request
+COUNT_CACHE_TTL = int(os.getenv("COUNT_CACHE_TTL", 0))
+
+count_cache = CountCache(ttl=COUNT_CACHE_TTL)
+
+
+def count_rows(query, column, cache_key=None):
+    def compute():
+        return query.order_by(None).with_entities(func.count(column)).scalar()
+
+    if cache_key is None:
+        return compute()
+    return count_cache.get(cache_key, compute)
+
+
+# fetch(query) loads the rows of the page, by default as ORM instances
+def paginate(query, sort_key, page, per_page, count_column, cache_key=None,
+             cursor=None, fetch=None):
+    selection = query.order_by(*sort_key.order_by())
+    if cursor:
+        selection = selection.filter(
+            sort_key.after(sort_key.decode_cursor(cursor)))
+    else:
+        selection = selection.offset((page - 1) * per_page)
+    selection = selection.limit(per_page + 1)
+    rows = fetch(selection) if fetch is not None else selection.all()
+
+    next_page = next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_page = page + 1
+        next_cursor = sort_key.encode_cursor(rows[-1])
+    total = count_rows(query, count_column, cache_key)
+    return Page(rows, page, per_page, total, next_page, next_cursor)
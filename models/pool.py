@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import Pool, QueuePool
+
+'''
+Connection pool
+Pool sizing, recycling and pre-ping are read from the environment. The
+QueuePool used for server databases records how long every checkout waited
+for a connection, and pool events keep process wide counters, so the state
+of the pool can be inspected while the app is under load.
+SQLite keeps the pool chosen by SQLAlchemy, sizing options do not apply.
+'''
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.waits = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+
+    def increment(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.waits += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_seconds, 6),
+                'wait_seconds_max': round(self.max_wait_seconds, 6),
+                'wait_seconds_avg': round(self.wait_seconds / self.waits, 6)
+                if self.waits else 0.0
+            }
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    # _do_get blocks until a connection is free or pool_timeout expires
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.increment('timeouts')
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start)
+
+
+@event.listens_for(Pool, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    pool_stats.increment('connects')
+
+
+@event.listens_for(Pool, 'checkout')
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.increment('checkouts')
+
+
+@event.listens_for(Pool, 'checkin')
+def _on_checkin(dbapi_connection, connection_record):
+    pool_stats.increment('checkins')
+
+
+@event.listens_for(Pool, 'invalidate')
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_stats.increment('invalidations')
+
+
+# Value for SQLALCHEMY_ENGINE_OPTIONS
+def engine_options(database_path):
+    options = {
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'pool_recycle': DB_POOL_RECYCLE
+    }
+    try:
+        backend = make_url(database_path).get_backend_name()
+    except exc.ArgumentError:
+        return options
+    if backend != 'sqlite':
+        options.update({
+            'poolclass': TimedQueuePool,
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT
+        })
+    return options
+
+
+# Current state of the engine's pool plus the process wide counters
+def pool_status(engine):
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0)
+        })
+    status.update(pool_stats.snapshot())
+    return status
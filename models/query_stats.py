@@ -0,0 +1,117 @@
+import logging
+import os
+import re
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+'''
+Query accounting
+Opt-in (QUERY_ACCOUNTING) per request statistics of the SQL statements run
+while a request is handled: the count and total time are returned in the
+X-Query-Count and Server-Timing headers, and a warning is logged when the
+request runs more than QUERY_BUDGET statements or the same statement shape
+more than QUERY_REPEAT_LIMIT times (the usual sign of an N+1 pattern). With
+QUERY_BUDGET_STRICT the request fails with QueryBudgetExceeded instead,
+which is how the test suite uses it.
+Statements run by streamed responses after the view returned are not
+counted.
+'''
+
+QUERY_ACCOUNTING = os.getenv("QUERY_ACCOUNTING", "false").lower() == "true"
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", 20))
+QUERY_REPEAT_LIMIT = int(os.getenv("QUERY_REPEAT_LIMIT", 5))
+QUERY_BUDGET_STRICT = \
+    os.getenv("QUERY_BUDGET_STRICT", "false").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+# expanded IN lists and literals of the same statement share one shape
+_IN_LIST = re.compile(r'\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*'
+                      r'(?:\?|%\(\w+\)s|:\w+))*\s*\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_SPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self.started = time.perf_counter()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, limit):
+        return [(shape, count) for shape, count in self.shapes.items()
+                if count > limit]
+
+
+def statement_shape(statement):
+    shape = _IN_LIST.sub('(?)', statement)
+    shape = _LITERAL.sub('?', shape)
+    return _SPACE.sub(' ', shape).strip()
+
+
+def _current_stats():
+    if not has_request_context():
+        return None
+    return g.get('query_stats')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if _current_stats() is not None:
+        conn.info.setdefault('query_stats_started', []) \
+            .append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = _current_stats()
+    started = conn.info.get('query_stats_started')
+    if stats is not None and started:
+        stats.record(statement, time.perf_counter() - started.pop())
+
+
+def start_accounting(config):
+    if config['QUERY_ACCOUNTING']:
+        g.query_stats = QueryStats()
+
+
+# Adds the headers and enforces the budget, returns the response
+def finish_accounting(response, config):
+    stats = g.pop('query_stats', None)
+    if stats is None:
+        return response
+    elapsed = time.perf_counter() - stats.started
+    response.headers['X-Query-Count'] = str(stats.count)
+    response.headers.add(
+        'Server-Timing',
+        f'db;dur={stats.seconds * 1000:.3f};desc="{stats.count} queries", '
+        f'app;dur={elapsed * 1000:.3f}')
+
+    problems = []
+    if stats.count > config['QUERY_BUDGET']:
+        problems.append(f'{stats.count} queries, budget is '
+                        f'{config["QUERY_BUDGET"]}')
+    for shape, count in stats.repeated(config['QUERY_REPEAT_LIMIT']):
+        problems.append(f'statement repeated {count} times: {shape}')
+    if problems:
+        message = f'{request.method} {request.path}: ' + '; '.join(problems)
+        if config['QUERY_BUDGET_STRICT']:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+    return response
@@ -0,0 +1,95 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from models.dbmodel import db, Actor, Movie
+
+'''
+Read-only rows
+List pages and exports only read the columns they return, so they skip the
+ORM: the query is compiled to a Core select of the FIELDS columns and every
+result row is copied into a namedtuple (no __dict__, no identity map, no
+instance state). The rows format() like their model.
+Sparse fieldsets (fields=) use rows of only the requested columns plus the
+ones the page needs for itself, such as the sort columns of the cursor.
+'''
+
+GENDERS = {
+    'M': 'Male',
+    'F': 'Female'
+}
+
+
+class ActorRow(namedtuple('ActorRow', Actor.FIELDS)):
+    __slots__ = ()
+
+    def format(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'age': self.age,
+            'gender': GENDERS.get(self.gender, 'Unknown'),
+            'identifier': self.identifier
+        }
+
+
+class MovieRow(namedtuple('MovieRow', Movie.FIELDS)):
+    __slots__ = ()
+
+    def format(self):
+        return dict(zip(Movie.FIELDS, self))
+
+
+ROW_CLASSES = {
+    Actor: ActorRow,
+    Movie: MovieRow
+}
+
+# (model, field) -> API value of a column value, other fields are returned
+# as they are
+FIELD_FORMATS = {
+    (Actor, 'gender'): lambda gender: GENDERS.get(gender, 'Unknown')
+}
+
+
+# Row of the given columns of model, format() returns only fields
+@lru_cache(maxsize=None)
+def partial_row_class(model, columns, fields):
+    formats = [(field, columns.index(field),
+                FIELD_FORMATS.get((model, field), lambda value: value))
+               for field in fields]
+
+    def format(self):
+        return {field: to_api(self[index]) for field, index, to_api in formats}
+
+    return type(f'{model.__name__}Row', (namedtuple('Row', columns),),
+                {'__slots__': (), 'format': format})
+
+
+# Core statement of an ORM query on model that selects only the row fields
+def row_statement(model, query, row_class=None):
+    row_class = row_class or ROW_CLASSES[model]
+    return query.with_entities(
+        *[getattr(model, field) for field in row_class._fields]).statement
+
+
+def select_rows(model, query, row_class=None):
+    row_class = row_class or ROW_CLASSES[model]
+    result = db.session.execute(row_statement(model, query, row_class))
+    return [row_class._make(row) for row in result]
+
+
+# Streams the rows through a server-side cursor, batch_size rows at a time
+def iter_rows(model, query, batch_size):
+    row_class = ROW_CLASSES[model]
+    statement = row_statement(model, query) \
+        .execution_options(stream_results=True)
+    result = db.session.execute(statement)
+    try:
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row_class._make(row)
+    finally:
+        result.close()
@@ -0,0 +1,139 @@
+import re
+
+from sqlalchemy import DDL, event, text
+
+from models.dbmodel import db, Actor, Movie
+
+'''
+Full-text search
+Actor names and movie titles are indexed by the database itself so every
+write path, including bulk inserts, keeps the index in sync:
+- PostgreSQL: a generated tsvector column with a GIN index on each table
+  (PostgreSQL 12 or later)
+- SQLite: one FTS5 table per model whose rowid is the entity id, maintained
+  by triggers
+Each word of the query is matched as a prefix, results are ranked with
+ts_rank / bm25.
+'''
+
+SEARCH_KINDS = {
+    'actor': Actor,
+    'movie': Movie
+}
+
+_SEARCH_COLUMNS = {
+    'actors': 'name',
+    'movies': 'title'
+}
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _postgresql_ddl(table, column):
+    return [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector "
+        f"tsvector GENERATED ALWAYS AS "
+        f"(to_tsvector('simple', coalesce({column}, ''))) STORED",
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_search_vector "
+        f"ON {table} USING GIN (search_vector)"
+    ]
+
+
+def _sqlite_ddl(table, column):
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_search "
+        f"USING fts5({column})",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_search_insert "
+        f"AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {table}_search(rowid, {column}) "
+        f"VALUES (new.id, new.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_search_update "
+        f"AFTER UPDATE OF {column} ON {table} BEGIN "
+        f"UPDATE {table}_search SET {column} = new.{column} "
+        f"WHERE rowid = old.id; END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_search_delete "
+        f"AFTER DELETE ON {table} BEGIN "
+        f"DELETE FROM {table}_search WHERE rowid = old.id; END"
+    ]
+
+
+def search_index_ddl(dialect, table, column):
+    if dialect == 'postgresql':
+        return _postgresql_ddl(table, column)
+    if dialect == 'sqlite':
+        return _sqlite_ddl(table, column)
+    return []
+
+
+# create_all / drop_all also create and drop the search index
+def register_search_ddl():
+    for model in SEARCH_KINDS.values():
+        table = model.__tablename__
+        for dialect in ('postgresql', 'sqlite'):
+            for statement in search_index_ddl(dialect, table,
+                                              _SEARCH_COLUMNS[table]):
+                event.listen(model.__table__, 'after_create',
+                             DDL(statement).execute_if(dialect=dialect))
+        event.listen(model.__table__, 'after_drop',
+                     DDL(f"DROP TABLE IF EXISTS {table}_search")
+                     .execute_if(dialect='sqlite'))
+
+
+register_search_ddl()
+
+
+def _kind_query(dialect, kind):
+    table = SEARCH_KINDS[kind].__tablename__
+    if dialect == 'postgresql':
+        return (f"SELECT '{kind}' AS kind, id, "
+                f"ts_rank(search_vector, to_tsquery('simple', :query)) "
+                f"AS score FROM {table} "
+                f"WHERE search_vector @@ to_tsquery('simple', :query)")
+    return (f"SELECT '{kind}' AS kind, rowid AS id, "
+            f"-bm25({table}_search) AS score FROM {table}_search "
+            f"WHERE {table}_search MATCH :query")
+
+
+def _match_expression(dialect, words):
+    if dialect == 'postgresql':
+        return ' & '.join(f"{word}:*" for word in words)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+# Returns up to limit (kind, id, score) tuples ordered by relevance
+def search_ids(q, kinds, limit, offset=0):
+    words = _WORD.findall(q.lower())
+    if not words or not kinds:
+        return []
+    dialect = db.engine.dialect.name
+    union = ' UNION ALL '.join(_kind_query(dialect, kind) for kind in kinds)
+    statement = text(f"SELECT kind, id, score FROM ({union}) AS matches "
+                     f"ORDER BY score DESC, kind, id "
+                     f"LIMIT :limit OFFSET :offset")
+    return db.session.execute(statement, {
+        'query': _match_expression(dialect, words),
+        'limit': limit,
+        'offset': offset
+    }).fetchall()
+
+
+# Formats the matched entities with one query per kind, in ranking order
+def load_results(matches):
+    ids = {}
+    for kind, entity_id, score in matches:
+        ids.setdefault(kind, []).append(entity_id)
+    entities = {}
+    for kind, kind_ids in ids.items():
+        model = SEARCH_KINDS[kind]
+        for entity in model.query.filter(model.id.in_(kind_ids)):
+            entities[(kind, entity.id)] = entity.format()
+    results = []
+    for kind, entity_id, score in matches:
+        details = entities.get((kind, entity_id))
+        if details is not None:
+            results.append({
+                'type': kind,
+                'score': round(score, 6),
+                'details': details
+            })
+    return results
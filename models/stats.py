@@ -0,0 +1,148 @@
+from sqlalchemy import event, func, inspect, text
+from sqlalchemy.orm import Session
+
+from models.dbmodel import db, Actor, Movie, CatalogueStat
+
+'''
+Catalogue statistics
+Counts of actors by gender and age bucket and of movies by production house
+and OTT partner, kept in the catalogue_stats table. The counters change in
+the transaction of the write that changes the catalogue:
+- ORM inserts, updates and deletes through a before_flush listener that
+  reads the old values from the attribute history
+- Core bulk inserts (bulk endpoints, manage.py import) by calling
+  rows_added() before they commit
+recompute_stats() (manage.py recompute_stats) rebuilds the table from the
+catalogue to repair drift, e.g. after rows were changed with raw SQL.
+'''
+
+AGE_BUCKETS = ((0, 17), (18, 24), (25, 34), (35, 44), (45, 54), (55, 64))
+# counter of rows without production house / OTT partner
+NONE_BUCKET = '(none)'
+
+# dimension -> (model, column)
+DIMENSIONS = {
+    'actor_gender': (Actor, 'gender'),
+    'actor_age': (Actor, 'age'),
+    'movie_production_house': (Movie, 'production_house'),
+    'movie_ott_partner': (Movie, 'ott_partner')
+}
+
+
+def age_bucket(age):
+    for low, high in AGE_BUCKETS:
+        if age <= high:
+            return f'{low}-{high}'
+    return f'{AGE_BUCKETS[-1][1] + 1}+'
+
+
+def bucket(dimension, value):
+    if dimension == 'actor_age':
+        return age_bucket(value)
+    if value is None or value == '':
+        return NONE_BUCKET
+    return str(value)
+
+
+# {(dimension, bucket): delta} of one row of model appearing (+1) or
+# disappearing (-1)
+def row_deltas(model, values, sign, deltas):
+    for dimension, (dimension_model, column) in DIMENSIONS.items():
+        if dimension_model is model:
+            key = (dimension, bucket(dimension, values[column]))
+            deltas[key] = deltas.get(key, 0) + sign
+    return deltas
+
+
+# One executemany upsert, buckets created by a concurrent transaction are
+# added to instead of failing on the primary key (PostgreSQL, SQLite 3.24+).
+# Rows go in key order, so concurrent writers lock buckets in the same order.
+UPSERT_STAT = text(
+    'INSERT INTO catalogue_stats (dimension, bucket, count) '
+    'VALUES (:dimension, :bucket, :delta) '
+    'ON CONFLICT (dimension, bucket) '
+    'DO UPDATE SET count = catalogue_stats.count + excluded.count')
+
+
+def apply_deltas(session, deltas):
+    rows = [{'dimension': dimension, 'bucket': bucket_name, 'delta': delta}
+            for (dimension, bucket_name), delta in sorted(deltas.items())
+            if delta]
+    if rows:
+        session.execute(UPSERT_STAT, rows)
+
+
+def _values(entity, columns, old=False):
+    values = {}
+    state = inspect(entity)
+    for column in columns:
+        history = state.attrs[column].load_history()
+        if old and history.has_changes():
+            values[column] = history.deleted[0] if history.deleted else None
+        else:
+            values[column] = getattr(entity, column)
+    return values
+
+
+def _columns(model):
+    return [column for dimension_model, column in DIMENSIONS.values()
+            if dimension_model is model]
+
+
+@event.listens_for(Session, 'before_flush')
+def _count_changes(session, flush_context, instances):
+    deltas = {}
+    for entity in session.new:
+        model = type(entity)
+        if model in (Actor, Movie):
+            row_deltas(model, _values(entity, _columns(model)), 1, deltas)
+    for entity in session.deleted:
+        model = type(entity)
+        if model in (Actor, Movie):
+            row_deltas(model, _values(entity, _columns(model), old=True),
+                       -1, deltas)
+    for entity in session.dirty:
+        model = type(entity)
+        if model not in (Actor, Movie) or \
+                not session.is_modified(entity, include_collections=False):
+            continue
+        columns = _columns(model)
+        row_deltas(model, _values(entity, columns, old=True), -1, deltas)
+        row_deltas(model, _values(entity, columns), 1, deltas)
+    if deltas:
+        apply_deltas(session, deltas)
+
+
+# Core inserts bypass the flush, call before committing them
+def rows_added(model, rows):
+    deltas = {}
+    for row in rows:
+        row_deltas(model, row, 1, deltas)
+    apply_deltas(db.session, deltas)
+
+
+def recompute_stats():
+    table = CatalogueStat.__table__
+    deltas = {}
+    for dimension, (model, column) in DIMENSIONS.items():
+        attribute = getattr(model, column)
+        counts = db.session.query(attribute, func.count(model.id)) \
+            .group_by(attribute)
+        for value, count in counts:
+            key = (dimension, bucket(dimension, value))
+            deltas[key] = deltas.get(key, 0) + count
+    try:
+        db.session.execute(table.delete())
+        apply_deltas(db.session, deltas)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(deltas)
+
+
+def get_stats():
+    stats = {}
+    for stat in CatalogueStat.query.filter(CatalogueStat.count != 0):
+        stats.setdefault(stat.dimension, {})[stat.bucket] = stat.count
+    return stats